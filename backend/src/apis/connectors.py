@@ -2,7 +2,8 @@
     Connector Dependencies
 """
 from src.db.sqlalchemy.database import SessionLocal
-from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
+from src.db.timescale_db.async_tsdb_connector_pool import get_async_pool
+from src.db.timescale_db.tsdb_connector_pool import get_pool
 
 
 def get_db():
@@ -14,8 +15,10 @@ def get_db():
 
 
 def get_connector():
-    pool = TimescaleDBConnectorPool()
-    try:
-        yield pool
-    finally:
-        pool.disconnect()
+    yield get_pool()
+
+
+async def get_async_connector():
+    pool = get_async_pool()
+    await pool.connect()
+    yield pool
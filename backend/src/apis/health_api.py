@@ -4,6 +4,9 @@ from fastapi import APIRouter
 from starlette.responses import Response
 from starlette.status import HTTP_204_NO_CONTENT
 
+from src.controllers.cache_controller import cache
+from src.db.timescale_db.tsdb_connector_pool import get_pool
+from src.models.models.health import CacheMetrics, PoolMetrics
 
 router = APIRouter(tags=["health"])
 
@@ -12,3 +15,15 @@ router = APIRouter(tags=["health"])
 async def get() -> Response:
     """Check server health"""
     return Response(status_code=HTTPStatus.NO_CONTENT)
+
+
+@router.get("/pool", response_model=PoolMetrics)
+async def get_pool_metrics() -> PoolMetrics:
+    """Returns usage metrics of the TimescaleDB connection pool"""
+    return PoolMetrics(**get_pool().metrics())
+
+
+@router.get("/cache", response_model=CacheMetrics)
+async def get_cache_metrics() -> CacheMetrics:
+    """Returns hit, miss and eviction counters of the in-process project cache"""
+    return CacheMetrics(**cache.stats())
@@ -1,14 +1,16 @@
 from typing import List
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from sqlalchemy.orm import Session
 
 from src.apis.connectors import get_db, get_connector
 from src.controllers import label_class_controller, label_controller
+from src.controllers.dtw_controller import align_added_labels, align_updated_label, align_removed_labels
 from src.controllers.prediction_controller import predict
-from src.db.timescale_db.tsdb_connector import TimescaleDBConnector
-from src.models.models.label import Label, LabelClass, CreateLabel, CreateLabelClass
+from src.controllers.similarity_controller import find_similar_windows
+from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
+from src.models.models.label import Label, LabelClass, CreateLabel, CreateLabelClass, SimilarWindow
 from src.models.models.prediction import Prediction, PredictionRequest
 
 router = APIRouter(prefix="/labels", tags=["labels"])
@@ -33,32 +35,46 @@ def get_labels(project: UUID, db: Session = Depends(get_db)) -> List[Label]:
 
 
 @router.put("", response_model=Label)
-def update_label(label: Label, db: Session = Depends(get_db)) -> Label:
+def update_label(label: Label, background_tasks: BackgroundTasks, db: Session = Depends(get_db)) -> Label:
     update = {key: label.dict()[key] for key in ["label_class", "start", "end"]}
     db_label = label_controller.label.get(db=db, uuid=label.id)
-    return label_controller.label.update(db=db, db_obj=db_label, update_obj=update)
+    db_label = label_controller.label.update(db=db, db_obj=db_label, update_obj=update)
+    background_tasks.add_task(align_updated_label, db_label.project, db_label.id)
+    return db_label
 
 
 @router.post("", response_model=List[Label])
-def set_labels(project: UUID, labels: List[CreateLabel], db: Session = Depends(get_db)) -> List[Label]:
-    return label_controller.label.create(db=db, project_id=project, create=labels)
+def set_labels(project: UUID, labels: List[CreateLabel], background_tasks: BackgroundTasks, db: Session = Depends(get_db)) -> List[Label]:
+    db_labels = label_controller.label.create(db=db, project_id=project, create=labels)
+    background_tasks.add_task(align_added_labels, project, [db_label.id for db_label in db_labels])
+    return db_labels
 
 
 @router.delete("/{uuid}", response_model=Label)
-def delete_label(uuid: UUID, db: Session = Depends(get_db)) -> Label:
-    return label_controller.label.remove(db=db, uuid=uuid)
+def delete_label(uuid: UUID, background_tasks: BackgroundTasks, db: Session = Depends(get_db)) -> Label:
+    db_label = label_controller.label.remove(db=db, uuid=uuid)
+    background_tasks.add_task(align_removed_labels, db_label.project, {db_label.label_class})
+    return db_label
 
 
 @router.delete("")
-def delete_labels_by_sample(project: UUID, sample: int, db: Session = Depends(get_db)) -> Label:
-    return label_controller.label.delete_by_sample(db=db, sample=sample, project_id=project)
+def delete_labels_by_sample(project: UUID, sample: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)) -> Label:
+    label_classes = {db_label.label_class for db_label in label_controller.label.get_all(db=db, project_id=project) if db_label.sample == sample}
+    result = label_controller.label.delete_by_sample(db=db, sample=sample, project_id=project)
+    background_tasks.add_task(align_removed_labels, project, label_classes)
+    return result
 
 
 @router.post("/predictions", response_model=Prediction)
-async def predict_labels(project: UUID, prediction: PredictionRequest, db: Session = Depends(get_db), connector: TimescaleDBConnector = Depends(get_connector)) -> Prediction:
+async def predict_labels(project: UUID, prediction: PredictionRequest, db: Session = Depends(get_db), connector: TimescaleDBConnectorPool = Depends(get_connector)) -> Prediction:
     return predict(project_uuid=project, prediction=prediction, db=db, connector=connector)
 
 
+@router.get("/similar", response_model=List[SimilarWindow])
+def get_similar_windows(project: UUID, sample: int, start: int, end: int, k: int = 10, db: Session = Depends(get_db), connector: TimescaleDBConnectorPool = Depends(get_connector)) -> List[SimilarWindow]:
+    return find_similar_windows(project_uuid=project, sample=sample, start=start, end=end, k=k, db=db, connector=connector)
+
+
 @router.get("/export")
 async def export_labels(project: UUID, db: Session = Depends(get_db)):
     return label_controller.label.export_labels(db=db, project_id=project)
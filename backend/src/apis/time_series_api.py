@@ -1,41 +1,58 @@
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Query
 from sqlalchemy.orm import Session
 
-from src.apis.connectors import get_connector, get_db
+from src.apis.connectors import get_async_connector, get_db
 from src.controllers.time_series_controller import TimeSeriesController
-from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
+from src.controllers.util.time_series_frames import BINARY_MEDIA_TYPE, BINARY_STREAM_MEDIA_TYPE, NDJSON_MEDIA_TYPE, accepts_binary
+from src.db.timescale_db.async_tsdb_connector_pool import AsyncTimescaleDBConnectorPool
 from src.models.models.time_series import TimeSeries, TimeSeriesProject, TimeSeriesSample
 
 router = APIRouter(prefix="/ts", tags=["time-series"])
 
+binary_content = {BINARY_MEDIA_TYPE: {}}
+stream_content = {NDJSON_MEDIA_TYPE: {}, BINARY_STREAM_MEDIA_TYPE: {}}
 
-@router.get("/{uuid}", responses={200: {"model": TimeSeriesProject, "description": "A list of time series."}})
-async def get_time_series(uuid: UUID, db: Session = Depends(get_db), connector: TimescaleDBConnectorPool = Depends(get_connector)) -> TimeSeriesProject:
+
+@router.get("/{uuid}", responses={200: {"model": TimeSeriesProject, "description": "A list of time series.", "content": binary_content}})
+async def get_time_series(uuid: UUID, db: Session = Depends(get_db), connector: AsyncTimescaleDBConnectorPool = Depends(get_async_connector), accept: Optional[str] = Header(None)) -> TimeSeriesProject:
     """Returns all time series from file"""
-    return TimeSeriesController.query_time_series(uuid=uuid, db=db, connector=connector)
+    return await TimeSeriesController.query_time_series(uuid=uuid, db=db, connector=connector, binary=accepts_binary(accept))
 
 
-@router.get("/{uuid}/samples", responses={200: {"model": List[TimeSeriesSample], "description": "A list of time series."}})
-async def get_time_series_samples(uuid: UUID, db: Session = Depends(get_db), connector: TimescaleDBConnectorPool = Depends(get_connector)) -> List[dict]:
-    """Returns all time series samples"""
+@router.get("/{uuid}/samples", responses={200: {"model": List[TimeSeriesSample], "description": "A list of time series.", "content": {**binary_content, **stream_content}}})
+async def get_time_series_samples(uuid: UUID, stream: bool = False, db: Session = Depends(get_db), connector: AsyncTimescaleDBConnectorPool = Depends(get_async_connector), accept: Optional[str] = Header(None)) -> List[dict]:
+    """Returns all time series samples, with stream set one sample at a time"""
     """ We could do typecasting with
         from pydantic import parse_obj_as 
         parse_obj_as(List[TimeSeriesSample], samples)
         but it takes a lot of time
     """
-    return TimeSeriesController.query_time_series_samples(uuid=uuid, db=db, connector=connector)
+    if stream:
+        return TimeSeriesController.stream_time_series_samples(uuid=uuid, db=db, connector=connector, binary=accepts_binary(accept))
+    return await TimeSeriesController.query_time_series_samples(uuid=uuid, db=db, connector=connector, binary=accepts_binary(accept))
+
+
+@router.get("/{uuid}/{sample}", responses={200: {"model": TimeSeriesSample, "description": "A sample time series", "content": binary_content}})
+async def get_time_series_sample(uuid: UUID, sample: int, start: Optional[float] = None, end: Optional[float] = None, max_points: Optional[int] = Query(None, gt=0),
+                                 db: Session = Depends(get_db), connector: AsyncTimescaleDBConnectorPool = Depends(get_async_connector), accept: Optional[str] = Header(None)) -> TimeSeriesSample:
+    """Returns time series sample from file, optionally between start and end (epoch ms) with at most max_points points per dimension"""
+    return await TimeSeriesController.query_time_series_sample(uuid=uuid, sample=sample, db=db, connector=connector, binary=accepts_binary(accept), start=start, end=end, max_points=max_points)
 
 
-@router.get("/{uuid}/{sample}", responses={200: {"model": TimeSeriesSample, "description": "A sample time series"}})
-async def get_time_series_sample(uuid: UUID, sample: int, db: Session = Depends(get_db), connector: TimescaleDBConnectorPool = Depends(get_connector)) -> TimeSeriesSample:
-    """Returns time series sample from file"""
-    return TimeSeriesController.query_time_series_sample(uuid=uuid, sample=sample, db=db, connector=connector)
+@router.get("/{uuid}/{sample}/{dimension}", responses={200: {"model": TimeSeriesSample, "description": "A sample time series dimension.", "content": binary_content}})
+async def get_time_series_sample_dimension(uuid: UUID, sample: int, dimension: int, start: Optional[float] = None, end: Optional[float] = None, max_points: Optional[int] = Query(None, gt=0),
+                                           db: Session = Depends(get_db), connector: AsyncTimescaleDBConnectorPool = Depends(get_async_connector), accept: Optional[str] = Header(None)) -> TimeSeries:
+    """Returns time series sample dimension from file, optionally between start and end (epoch ms) with at most max_points points"""
+    return await TimeSeriesController.query_time_series_sample_dimension(uuid=uuid, sample=sample, dimension=dimension, db=db, connector=connector, binary=accepts_binary(accept),
+                                                                         start=start, end=end, max_points=max_points)
 
 
-@router.get("/{uuid}/{sample}/{dimension}", responses={200: {"model": TimeSeriesSample, "description": "A sample time series dimension."}})
-async def get_time_series_sample_dimension(uuid: UUID, sample: int, dimension: int, db: Session = Depends(get_db), connector: TimescaleDBConnectorPool = Depends(get_connector)) -> TimeSeries:
-    """Returns time series sample dimension from file"""
-    return TimeSeriesController.query_time_series_sample_dimension(uuid=uuid, sample=sample, dimension=dimension, db=db, connector=connector)
+@router.get("/{uuid}/{sample}/{dimension}/view", responses={200: {"model": TimeSeries, "description": "A sample time series dimension in a time range.", "content": binary_content}})
+async def get_time_series_sample_dimension_view(uuid: UUID, sample: int, dimension: int, pixel_width: int = Query(..., gt=0), start: Optional[float] = None, end: Optional[float] = None,
+                                                db: Session = Depends(get_db), connector: AsyncTimescaleDBConnectorPool = Depends(get_async_connector), accept: Optional[str] = Header(None)) -> TimeSeries:
+    """Returns time series sample dimension between start and end (epoch ms) with at least pixel_width points, aggregated as far as possible"""
+    return await TimeSeriesController.query_time_series_view(uuid=uuid, sample=sample, dimension=dimension, start=start, end=end, pixel_width=pixel_width, db=db, connector=connector,
+                                                             binary=accepts_binary(accept))
@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Optional
 
 from pydantic import BaseSettings
 
@@ -14,14 +15,51 @@ class Settings(BaseSettings):
     db_url = "localhost"
     db_database = "postgres"
     db_port = "5432"
+    db_pool_min_conn = 2
+    db_pool_max_conn = 20
+    db_pool_timeout = 30
+    db_pool_max_lifetime = 1800
+    db_pool_idle_check = 30
 
     redis_url = "localhost"
     redis_port = 6379
 
-    DATA_PER_SECOND = 700000
     MAX_SAMPLES = 500000
     MAX_DATA_POINTS = 25000000
+    STREAM_BATCH_SIZE = 50000
+    # data points per batch when moving an uploaded project into the database
+    INGEST_BATCH_ROWS = 1000000
+    # connections copying batches concurrently and batches waiting for a free connection
+    INGEST_CONNECTIONS = 4
+    INGEST_QUEUE_SIZE = 8
+    # build the indexes after loading instead of maintaining them for every copied row
+    INGEST_DEFER_INDEXES = True
+    INGEST_PARALLEL_INDEXES = True
+    INGEST_INDEX_MEMORY = "256MB"
+    # rows per hypertable chunk the chunk interval is chosen for
+    INGEST_CHUNK_ROWS = 10000000
+    # processes downsampling uploads, None uses all cores
+    LTTB_WORKERS: Optional[int] = None
+    # every pyramid level aggregates PYRAMID_FACTOR buckets of the level below, until a level has at most PYRAMID_MIN_POINTS
+    PYRAMID_FACTOR = 4
+    PYRAMID_MIN_POINTS = 256
+    # open project stores kept by every worker
+    CACHE_MAX_ENTRIES = 32
+    DTW_N_JOBS = -1
+    # Sakoe-Chiba band radius of the label search, None searches without constraint
+    DTW_RADIUS: Optional[int] = None
+    # processes aligning labels, None uses all cores
+    DTW_ALIGN_WORKERS: Optional[int] = None
+    FEATURE_WINDOW = 128
+    FEATURE_WINDOW_STEP = 64
+    FEATURE_PAA_SEGMENTS = 8
+    # candidates retrieved from the feature index per requested similar window before the DTW re-ranking
+    SIMILARITY_CANDIDATES = 10
     INTEGRATION_PROGRESS_CHANNEL = "integration-progress"
+    CACHE_INVALIDATION_CHANNEL = "cache-invalidation"
+    CACHE_GENERATION_KEY = "cache-generation"
+    # seconds a generation is trusted without reading Redis, covers invalidations missed while pub/sub reconnects
+    CACHE_GENERATION_TTL = 30
 
 
 @lru_cache()
@@ -1,133 +1,206 @@
-import sktime.datasets
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import joblib
+import numpy as np
 from modAL.models import ActiveLearner
 from modAL.uncertainty import uncertainty_sampling
+from sklearn.ensemble import RandomForestClassifier
 
-from sqlalchemy.orm import Session
-
-from src.models.models.project import Project
-from src.db.timescale_db.tsdb_connector import TimescaleDBConnector
-from src.db.sqlalchemy.database import SessionLocal
-from src.controllers.label_controller import label
-from src.controllers.label_class_controller import labelClass
 from src.controllers.cache_controller import cache
+from src.controllers.label_class_controller import labelClass
+from src.controllers.label_controller import label
+from src.controllers.util.interval_join import overlapping_labels
+from src.controllers.util.windowing import sample_matrix, split_into_windows, window_bounds
+from src.db.sqlalchemy.database import SessionLocal
+from src.db.timescale_db.tsdb_connector_pool import get_pool
+from src.models.models.project import Project
 
-from typing import Union
-import numpy as np
-import pandas as pd
-from pandas import DataFrame
 
-import uuid
-from sktime.classification.distance_based import ProximityForest
+class ActiveLearningController:
+    """
+    Active learning session of a project.
 
+    The windowed dataset is built once per cached project generation. Labels are applied incrementally and the learner
+    is only taught the windows of new labels, the uncertainty of all unlabeled windows is cached after every update
+    so suggestions do not touch the model.
+    """
 
-class ActiveLearningController:
-    # connector: TimescaleDBConnector, session: Session
-    def __init__(self, project: Project, window_size):
-        self.session = SessionLocal()
-        self.samples = cache.read_from_cache(project.id)
+    def __init__(self, project: Project, window_size: int):
         self.project = project
         self.window_size = window_size
-        self.__generate_active_learner()
-        self.labeled_y = None
-        self.labeled_X = None
-
-    def __create_active_learner(self) -> None:
-        """ generates the active learning model """
-        # Hier das Modell ohne Active learning testen
-        # vorher noch die series zu sliding umbauen
-        #
-        ProximityForest()
-
-    def __generate_active_learner(self) -> None:
+        self.generation = cache.generation(project.id)
+        self.samples = self.__read_samples()
+        self.learner = ActiveLearner(estimator=RandomForestClassifier(), query_strategy=uncertainty_sampling)
+        self.fitted = False
+        # label id -> (sample, start, end, target) of all labels the learner knows
+        self.applied_labels = {}
+        self.lock = threading.Lock()
+        self.update_dataset()
+
+    @staticmethod
+    def path(samples, window_size: int) -> Path:
+        return samples.path.joinpath(f'active_learning_{window_size}.joblib')
+
+    @staticmethod
+    def features_path(samples, window_size: int) -> Path:
+        return samples.path.joinpath(f'active_learning_{window_size}.npy')
+
+    @classmethod
+    def load(cls, project: Project, window_size: int) -> Optional['ActiveLearningController']:
         """
-        Creates a dataset & active learner that is the basis for this modul
+        Loads a stored session of the current project generation
         """
-        self.update_dataset()
-        self.__create_active_learner()
-
-    def __get_labels(self)-> list:
-        """ Get all labels that were labeled"""
-        all_project_labels = label.get_all(db=self.session, project_id=self.project.id, skip=0)
-        label_list = [[el.sample, el.label_class, el.start, el.end] for el in all_project_labels]
-        label_classes = labelClass.get_all(db=self.session, project_id=self.project.id)
-        labels = label_list[:]
-        for idx, l in enumerate(label_list):
-            for cl in label_classes:
-                if l[1] == cl.id:
-                    labels[idx][1] = cl.name
-                    if cl.name != "Normal":
-                        labels[idx].append(0)
-                    else:
-                        labels[idx].append(1)
-        return labels
+        samples = cache.read_from_cache(project.id)
+        if not samples or not cls.path(samples, window_size).is_file():
+            return None
+        session = joblib.load(cls.path(samples, window_size))
+        session.project = project
+        session.samples = samples
+        session.X = np.load(cls.features_path(samples, window_size), mmap_mode='r')
+        session.lock = threading.Lock()
+        return session
+
+    def save(self) -> None:
+        """
+        Stores the session next to the cached project, the feature matrix is only written once.
+        Files are written under a temporary name and moved into place, so other workers never load a partial file.
+        """
+        features_path = self.features_path(self.samples, self.window_size)
+        if not features_path.is_file():
+            tmp = features_path.with_name(f'{features_path.name}.{os.getpid()}.tmp')
+            with open(tmp, 'wb') as f:
+                np.save(f, self.X)
+            os.replace(tmp, features_path)
+        path = self.path(self.samples, self.window_size)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        joblib.dump(self, tmp)
+        os.replace(tmp, path)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # features, memory mapped samples, project and lock are restored by load
+        del state['X'], state['samples'], state['project'], state['lock']
+        return state
+
+    def __read_samples(self):
+        samples = cache.read_from_cache(self.project.id)
+        if not samples:
+            samples = cache.db_to_cache(self.project, get_pool())
+        return samples
+
+    def __get_labels(self) -> dict:
+        """ Get all labels that were labeled as label id -> (sample, start, end, target)"""
+        with SessionLocal() as session:
+            all_project_labels = label.get_all(db=session, project_id=self.project.id, skip=0)
+            label_classes = {cl.id: cl.name for cl in labelClass.get_all(db=session, project_id=self.project.id)}
+            return {el.id: (el.sample, el.start, el.end, 1 if label_classes[el.label_class] == "Normal" else 0)
+                    for el in all_project_labels if el.label_class in label_classes}
 
     def update_dataset(self) -> None:
-        """ updates all datasets for active learning"""
-        df = None
-        for idx, tsSample in enumerate(self.samples):
-            data = list(map(lambda x: x['data'], tsSample['sample']))
-            timestamps = list(map(lambda x: x['timestamps'], tsSample['sample']))
-            sample_dimensions_chunked = [[np.array(el[i:i + self.window_size]) for i in range(0, len(el), self.window_size)] for
-                                         el in data]
-            sample_timestamps_chunked = [[np.array(el[i:i + self.window_size]) for i in range(0, len(el), self.window_size)] for
-                                         el in timestamps]
-            n_windows = len(sample_dimensions_chunked[0])
-            single_window_df = DataFrame()
-            for n in range(n_windows):
-                combined_row = {}
-                combined_row["sample"] = tsSample["id"]
-                combined_row["sample"] = combined_row["sample"]
-                # hier bei series 250 elemente gucken das es sliding windows gibt
-                for i, (dimension, window_ts) in enumerate(zip(sample_dimensions_chunked, sample_timestamps_chunked)):
-                    combined_row["ts-interval"] = [min(window_ts[n]), max(window_ts[n])]
-                    combined_row[f"dimension {i + 1}"] = pd.Series(dimension[n])
-                single_window_df = single_window_df.append(combined_row, ignore_index=True)
-            if df is None:
-                df = single_window_df
-            else:
-                df = df.append(single_window_df, ignore_index=True)
-        df = df.reset_index(drop=True)
-        df['targets'] = None
-        df['labeled'] = False
-        label_list = self.__get_labels()
-        for el in label_list:
-            df['targets'] = df.apply(lambda row: el[-1] if (
-                    (row["ts-interval"][0] <= el[2] <= row["ts-interval"][1]) or (
-                    row["ts-interval"][0] <= el[3] <= row["ts-interval"][1])
-            ) else row['targets'], axis=1)
-            df['labeled'] = df.apply(lambda row: True if (
-                    (row["ts-interval"][0] <= el[2] <= row["ts-interval"][1]) or (
-                    row["ts-interval"][0] <= el[3] <= row["ts-interval"][1])
-            ) else row['labeled'], axis=1)
-        self.complete_dataset = df
-        labeled_dataset = df[df["labeled"] == True].reset_index(drop=True)
-        X_test,y_test = sktime.datasets.load_UCR_UEA_dataset(name = "SpokenArabicDigits", return_X_y=True)
-        self.labeled_X = labeled_dataset.drop(columns=["targets", "labeled", "ts-interval", "sample"], axis=1)
-        self.labeled_X = X_test
-        self.labeled_y = labeled_dataset["targets"]
-        self.labeled_y = y_test
-
-    def get_label_suggestions(self):
-        """ Suggest new data points that are supposed to be labeled """
-        unlabeled_df = self.complete_dataset[self.complete_dataset["labeled"] != True]
-        X = unlabeled_df.drop(columns=["targets", "labeled", "ts-interval"], axis=1)
-        return self.AL.query(X)
-
+        """ builds the windowed dataset, all labels are applied again"""
+        values = sample_matrix(self.samples)
+        timestamps = sample_matrix(self.samples, timestamps=True)[:, 0]
+        windows = split_into_windows(values, self.window_size)
+        n_windows, n_samples = windows.shape[:2]
+        # one row per sample and window, ordered by sample, the dimensions of a window are concatenated
+        self.X = windows.swapaxes(0, 1).reshape((n_samples * n_windows, -1))
+        starts, ends = window_bounds(values.shape[-1], self.window_size)
+        self.window_samples = np.repeat(np.arange(1, n_samples + 1), n_windows)
+        self.window_bounds = np.stack((timestamps[:, starts].ravel(), timestamps[:, ends].ravel()), axis=-1)
+        self.targets = np.full(len(self.X), -1, dtype=np.int64)
+        self.uncertainty = np.zeros(len(self.X))
+        self.applied_labels = {}
+        self.sync()
+
+    @property
+    def labeled(self) -> np.ndarray:
+        return self.targets >= 0
+
+    def sync(self) -> None:
+        """
+        Applies the labels that changed since the last sync. New labels teach the learner their windows, changed or
+        removed labels refit it on all labeled windows.
+        """
+        with self.lock:
+            labels = self.__get_labels()
+            changed = any(labels.get(label_id) != applied for label_id, applied in self.applied_labels.items())
+            added = [label_id for label_id in labels if label_id not in self.applied_labels]
+            if not changed and not added:
+                return
+            if changed:
+                self.targets[:] = -1
+                added = list(labels)
+            owner = self.__overlapping([labels[label_id] for label_id in added])
+            new = np.flatnonzero(owner >= 0)
+            relabeled = changed or bool(np.any(self.targets[new] >= 0))
+            self.targets[new] = np.array([labels[label_id][3] for label_id in added], dtype=np.int64)[owner[new]]
+            self.applied_labels = labels
+            if relabeled:
+                self.__refit()
+            elif len(new):
+                self.learner.teach(self.X[new], self.targets[new])
+                self.fitted = True
+            self.__update_uncertainty()
+            self.save()
+
+    def __overlapping(self, labels: list) -> np.ndarray:
+        return overlapping_labels(self.window_samples, self.window_bounds[:, 0], self.window_bounds[:, 1],
+                                  np.array([el[0] for el in labels], dtype=np.int64),
+                                  np.array([el[1] for el in labels], dtype=np.int64),
+                                  np.array([el[2] for el in labels], dtype=np.int64))
+
+    def __refit(self) -> None:
+        labeled = np.flatnonzero(self.labeled)
+        self.learner = ActiveLearner(estimator=RandomForestClassifier(), query_strategy=uncertainty_sampling)
+        self.fitted = len(labeled) > 0
+        if self.fitted:
+            self.learner.teach(self.X[labeled], self.targets[labeled])
+
+    def __update_uncertainty(self) -> None:
+        unlabeled = np.flatnonzero(~self.labeled)
+        self.uncertainty[:] = 0
+        if self.fitted and len(unlabeled):
+            self.uncertainty[unlabeled] = 1 - self.learner.predict_proba(self.X[unlabeled]).max(axis=1)
+
+    def get_label_suggestions(self, n: int = 10) -> list[dict]:
+        """ Suggest the unlabeled windows the learner is most uncertain about """
+        unlabeled = np.flatnonzero(~self.labeled)
+        ranked = unlabeled[np.argsort(-self.uncertainty[unlabeled], kind='stable')[:n]]
+        return [{'sample': int(self.window_samples[idx]), 'start': int(self.window_bounds[idx, 0]),
+                 'end': int(self.window_bounds[idx, 1]), 'uncertainty': float(self.uncertainty[idx])} for idx in ranked]
 
     def teach(self):
         """Adds new datapoints to the training of the predictor"""
-        self.AL.teach(self.labeled_X, self.labeled_y)
+        self.sync()
 
     def predict(self, sample_id):
-        """ Return predictions for samples"""
-        # Hier sollte eine sample id reinkommen oder eine liste von denen
-        unlabeled_df = self.complete_dataset[self.complete_dataset["labeled"] == True]
-        X = unlabeled_df.drop(columns=["targets", "labeled", "ts-interval"], axis=1).reset_index(drop=True)
-        return self.AL.predict(X)
-
-# https://tslearn.readthedocs.io/en/stable/gen_modules/tslearn.utils.html#module-tslearn.utils
-
-if __name__ == "__main__":
-    project = Project(id=uuid.UUID("1f8f134e-877b-4313-8878-ef5dac721dc0").hex)
-    active_leaner = ActiveLearningController(window_size=500, project=project)
-    pass
\ No newline at end of file
+        """ Return predictions for the windows of a sample"""
+        return self.learner.predict(self.X[self.window_samples == sample_id])
+
+
+class ActiveLearningRegistry:
+    """
+    Keeps one active learning session per project and window size, sessions of older project generations are replaced
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, project: Project, window_size: int) -> ActiveLearningController:
+        key = (str(project.id), window_size)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session.generation != cache.generation(project.id):
+                session = ActiveLearningController.load(project, window_size)
+                if session is None or session.generation != cache.generation(project.id):
+                    session = ActiveLearningController(project, window_size)
+                self._sessions[key] = session
+        session.sync()
+        return session
+
+
+active_learning = ActiveLearningRegistry()
@@ -1,60 +1,180 @@
+import json
 import os
-import pickle
 import shutil
+import threading
+import time
 from pathlib import Path
+from typing import Union
 
-from src.controllers.util.time_util import time_string_to_js_timestamp
-from src.db.timescale_db.time_series_reader import query_time_series_samples
+import numpy as np
+
+from src.config.settings import get_settings
+from src.controllers.util.feature_index import FeatureIndex
+from src.controllers.util.lru_cache import LRUCache
+from src.controllers.util.redis import redis_instance
+from src.controllers.util.sample_store import SampleStore
+from src.controllers.util.time_util import to_js_timestamps
+from src.db.timescale_db.time_series_reader import query_time_series_columns
 from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
 from src.models.models.project import ProjectDB
 
 
 class CacheController:
+    """
+    Caches projects as memory mapped stores on disk with an in-process LRU tier of open store handles in front of them.
+    The handles only map the stores, their pages are loaded and evicted by the OS page cache.
+
+    Every project has a generation number in Redis that is increased whenever the project is written or deleted.
+    Cached data is stored per generation, so workers only trust data of the current generation. Invalidations are
+    published on a Redis channel to let all workers drop their in-process copies right away.
+    """
     src_path = Path(__file__).parents[1].absolute()
 
+    def __init__(self):
+        # open handles of the memory mapped stores
+        self.memory = LRUCache(get_settings().CACHE_MAX_ENTRIES)
+        # uuid -> (generation, monotonic time it was read from Redis)
+        self._generations = {}
+        self._generations_lock = threading.Lock()
+        self._listener = None
+
     def _get_cachepath(self) -> Path:
         cachepath = self.src_path.joinpath("cache")
         if not cachepath.exists():
             cachepath.mkdir()
         return cachepath
 
-    def read_from_cache(self, uuid):
-        if self._get_cachepath().joinpath(f'{uuid}.pkl').is_file():
-            with open(self._get_cachepath().joinpath(f'{uuid}.pkl'), 'rb') as pickle_file:
-                return pickle.load(pickle_file)
+    def _get_project_path(self, uuid, generation: int) -> Path:
+        return self._get_cachepath().joinpath(f'{uuid}.{generation}')
+
+    def start(self):
+        """
+        Subscribes to invalidations of other workers
+        """
+        if self._listener is None:
+            pubsub = redis_instance.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{get_settings().CACHE_INVALIDATION_CHANNEL: self.__on_invalidation})
+            self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def close(self):
+        """
+        Stops listening for invalidations and drops the in-process tier, the shared stores on disk are kept
+        """
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        with self._generations_lock:
+            self._generations.clear()
+        self.memory.clear()
+
+    def generation(self, uuid) -> int:
+        uuid = str(uuid)
+        with self._generations_lock:
+            known = self._generations.get(uuid)
+        if self._listener is not None and known is not None and time.monotonic() - known[1] < get_settings().CACHE_GENERATION_TTL:
+            return known[0]
+        generation = int(redis_instance.get(self.__generation_key(uuid)) or 0)
+        return self.__apply_generation(uuid, generation)
+
+    def invalidate(self, uuid) -> int:
+        """
+        Starts a new generation for a project and tells all workers about it
+        """
+        generation = redis_instance.incr(self.__generation_key(uuid))
+        self.__apply_generation(str(uuid), generation)
+        redis_instance.publish(get_settings().CACHE_INVALIDATION_CHANNEL, json.dumps({'id': str(uuid), 'generation': generation}))
+        return generation
+
+    def read_from_cache(self, uuid) -> Union[SampleStore, bool]:
+        generation = self.generation(uuid)
+        store = self.memory.get(f'{uuid}.{generation}')
+        if store is not None:
+            return store
+        path = self._get_project_path(uuid, generation)
+        if SampleStore.exists(path):
+            return self.__remember(uuid, generation, SampleStore(path))
         else:
             return False
 
-    def db_to_cache(self, project: ProjectDB, connector: TimescaleDBConnectorPool):
-        samples = query_time_series_samples(project, connector)
-        with open(self._get_cachepath().joinpath(f'{project.id}.pkl'), 'wb') as pickle_file:
-            pickle.dump(samples, pickle_file)
-        return samples
+    def db_to_cache(self, project: ProjectDB, connector: TimescaleDBConnectorPool) -> SampleStore:
+        generation = self.generation(project.id)
+        path = self._get_project_path(project.id, generation)
+        columns = query_time_series_columns(project, connector, path.with_name(f'{path.name}.{os.getpid()}.copy'))
+        return self.__remember(project.id, generation, SampleStore.write(path, columns['sample'], columns['series'], columns['timestamps'], columns['data'], project.samples, project.dimensions))
+
+    def feature_index(self, project: ProjectDB, connector: TimescaleDBConnectorPool, rebuild: bool = False) -> FeatureIndex:
+        """
+        Returns the feature index of the cached project, it is built if it does not exist yet
+        """
+        samples = self.read_from_cache(project.id)
+        if not samples:
+            samples = self.db_to_cache(project, connector)
+        path = samples.path.joinpath('features')
+        if FeatureIndex.exists(path) and not rebuild:
+            return FeatureIndex(path)
+        config = get_settings()
+        return FeatureIndex.write(path, samples, config.FEATURE_WINDOW, config.FEATURE_WINDOW_STEP, config.FEATURE_PAA_SEGMENTS)
 
     def delete_cache(self, uuid):
+        self.invalidate(uuid)
         try:
-            os.remove(self._get_cachepath().joinpath(f'{uuid}.pkl'))
-        except:
+            self.__remove_stale(str(uuid), None)
+        except OSError:
             print("cache could not be removed")
 
     def clear_cache(self):
+        self.memory.clear()
         shutil.rmtree(self._get_cachepath())
 
-    # Hier in der remove funktion des Project controllers aufrufen und die file im Ordner löschen
-
-    def cache_project_init(self, data, project):
-        sample_list = []
-        if not (self._get_cachepath().joinpath(f'{project.id}.pkl').is_file()):
-            for sample in range(project.samples):
-                sample_list.append({"id": sample + 1, 'sample': [{'id': dimension_idx + 1,
-                                                                  'data': [],
-                                                                  'timestamps': []} for dimension_idx in
-                                                                 range(project.dimensions)]})
-            for el in data:
-                sample_list[el[1]]["sample"][el[2]]["data"].append(el[3])
-                sample_list[el[1]]["sample"][el[2]]["timestamps"].append(time_string_to_js_timestamp(el[0]))
-            with open(self._get_cachepath().joinpath(f'{project.id}.pkl'), 'wb') as pickle_file:
-                pickle.dump(sample_list, pickle_file)
+    def stats(self) -> dict:
+        return self.memory.stats()
+
+    def cache_project_init(self, samples: np.ndarray, series: np.ndarray, timestamps: np.ndarray, values: np.ndarray, project):
+        """
+        Caches a project from its columns, timestamps are datetime64
+        """
+        generation = self.generation(project.id)
+        path = self._get_project_path(project.id, generation)
+        if not SampleStore.exists(path):
+            timestamps = to_js_timestamps(timestamps)
+            order = np.lexsort((timestamps, series, samples))
+            self.__remember(project.id, generation, SampleStore.write(path, samples[order], series[order], timestamps[order], values[order], project.samples, project.dimensions))
+
+    def __remember(self, uuid, generation: int, store: SampleStore) -> SampleStore:
+        self.memory.put(f'{uuid}.{generation}', store)
+        self.__remove_stale(str(uuid), generation)
+        return store
+
+    def __on_invalidation(self, message):
+        update = json.loads(message['data'])
+        self.__apply_generation(update['id'], update['generation'])
+
+    def __apply_generation(self, uuid: str, generation: int) -> int:
+        """
+        Keeps the newer of the known and the given generation and returns it
+        """
+        with self._generations_lock:
+            known = self._generations.get(uuid)
+            previous = None if known is None else known[0]
+            if previous is not None and previous > generation:
+                return previous
+            self._generations[uuid] = (generation, time.monotonic())
+        if previous is not None and previous != generation:
+            self.memory.invalidate(f'{uuid}.{previous}')
+        return generation
+
+    def __remove_stale(self, uuid: str, generation):
+        """
+        Removes the stores of all generations before the given one, or of all generations if none is given
+        """
+        for path in self._get_cachepath().glob(f'{uuid}.*'):
+            parts = path.name.split('.')
+            if len(parts) == 2 and parts[1].isdigit() and (generation is None or int(parts[1]) < generation):
+                shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def __generation_key(uuid) -> str:
+        return f'{get_settings().CACHE_GENERATION_KEY}:{uuid}'
 
 
 cache = CacheController()
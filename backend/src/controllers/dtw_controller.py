@@ -1,23 +1,30 @@
-import ast
+import json
+import logging
 import uuid
 from dataclasses import dataclass
 from typing import Any, Union, Optional
 from uuid import UUID
 
 import numpy as np
-import pandas as pd
 from dtwalign import dtw as dtw_func
+from fastapi.encoders import jsonable_encoder
+from joblib import Parallel, delayed, effective_n_jobs
 from pydantic import BaseModel
-from tslearn.metrics import dtw as dtw_measure
 
+from src.config.settings import get_settings
 from src.controllers.cache_controller import cache
+from src.controllers import project_controller
 from src.controllers.label_class_controller import labelClass
 from src.controllers.label_controller import label
+from src.controllers.label_template_controller import label_template, from_blob
+from src.controllers.util.dtw_search import NearestReferenceSearch, Reference
+from src.controllers.util.parallel_alignment import AlignmentGroup, align_groups
+from src.controllers.util.redis import redis_instance
+from src.controllers.util.sample_store import SampleStore
+from src.controllers.util.windowing import sample_matrix
 from src.db.sqlalchemy.database import SessionLocal
-from src.db.sqlalchemy.database import engine
-from src.db.timescale_db.time_series_reader import query_time_series_sample
-from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
-from src.models.models.label import Label
+from src.db.timescale_db.tsdb_connector_pool import get_pool
+from src.models.models.label import Label, AlignmentProgress
 from src.models.models.prediction import PredictionWindow
 from src.models.models.project import Project
 
@@ -29,6 +36,7 @@ class ProcessingLabel():
     end: int
     label_name: str
     label_id: UUID
+    label_class: UUID
 
 
 class LabelInDict(BaseModel):
@@ -41,17 +49,19 @@ class DTW_Controller:
     def __init__(self, project: Project):
         self.session = SessionLocal()
         self.samples = cache.read_from_cache(project.id)
+        if not self.samples:
+            self.samples = cache.db_to_cache(project, get_pool())
         self.project = project
 
-    @staticmethod
-    def convert_db_column_string_to_tuple(result: Union[pd.Series, pd.DataFrame]):
-        return [ast.literal_eval(el.replace("{", "").replace("}", "")) for el in result.tolist()]
+    @classmethod
+    def for_project(cls, project_id: UUID) -> 'DTW_Controller':
+        with SessionLocal() as db:
+            return cls(project=project_controller.project.get_or_error(db=db, uuid=project_id))
 
     @staticmethod
-    def match_label_to_timestamps_and_values(timestamps: list[int], data: list[float],
+    def match_label_to_timestamps_and_values(timestamps: Union[list[int], np.ndarray], data: Union[list[float], np.ndarray],
                                              label: Union[ProcessingLabel, PredictionWindow]) -> LabelInDict:
-        start_idx = timestamps.index(label.start)
-        end_idx = timestamps.index(label.end)
+        start_idx, end_idx = np.searchsorted(timestamps, [label.start, label.end])
         label_timeseries = np.array(data[start_idx:end_idx])
         if type(label) is ProcessingLabel:
             return LabelInDict(id=label.label_id, data=label_timeseries)
@@ -62,9 +72,8 @@ class DTW_Controller:
         for cl in label_classes:
             if label.label_class == cl.id:
                 return ProcessingLabel(sample_id=label.sample, start=label.start, end=label.end, label_name=cl.name,
-                                       label_id=label.id)
-            else:
-                return ValueError
+                                       label_id=label.id, label_class=cl.id)
+        raise ValueError(f"label class {label.label_class} does not exist")
 
     def __get_all_labels(self) -> list:
         """ Get all labels that were labeled"""
@@ -76,115 +85,273 @@ class DTW_Controller:
             for cl in label_classes:
                 if l[1] == cl.id:
                     labels.append(
-                        ProcessingLabel(sample_id=l[0], start=l[2], end=l[3], label_name=cl.name, label_id=l[4]))
+                        ProcessingLabel(sample_id=l[0], start=l[2], end=l[3], label_name=cl.name, label_id=l[4],
+                                        label_class=cl.id))
         return labels
 
     def align_all_labels(self) -> None:
-        """ Updates all datasets for active learning"""
+        """ Aligns every label to the reference label of its class and stores them as label templates"""
 
         labels = self.__get_all_labels()
         dtw_dict = {}
-        references = {}
-        aligned_labels = pd.DataFrame(columns=["data", "label_id", "dimension_idx", "label_name", "reference"])
-        results = {}
-        broken_labels = []
+        aligned_labels = []
 
         # Create Dictionary with aligned numbers
         for label in labels:
-            sample = next(filter(lambda x: x['id'] == label.sample_id, self.samples))
+            sample = self.samples.sample(label.sample_id)
 
-            # Add Entry for every label name/class in dict
-            if label.label_name not in dtw_dict:
-                dtw_dict[label.label_name] = {}
+            # Add Entry for every label class in dict
+            if label.label_class not in dtw_dict:
+                dtw_dict[label.label_class] = {}
 
             # loop over sample and create timeseries for start and end of each label
             for dimension in sample["sample"]:
-                if dimension['id'] not in dtw_dict[label.label_name]:
-                    dtw_dict[label.label_name][dimension['id']] = []
+                if dimension['id'] not in dtw_dict[label.label_class]:
+                    dtw_dict[label.label_class][dimension['id']] = []
                 result = self.match_label_to_timestamps_and_values(timestamps=dimension["timestamps"],
                                                                    data=dimension["data"], label=label)
-                dtw_dict[label.label_name][dimension["id"]].append(result)
+                dtw_dict[label.label_class][dimension["id"]].append(result)
 
         # Get The Longest Label for each Dimension and Label Class and declare them as reference label
-        for label_name in dtw_dict.keys():
-            references[label_name] = {}
-            for dimension_id in dtw_dict[label_name].keys():
-                references[label_name][dimension_id] = \
-                    sorted(dtw_dict[label_name][dimension_id], key=lambda x: len(x.data), reverse=True)[0]
-
-        # Align other labels with reference label
-        for label_name in dtw_dict.keys():
-            for dimension_id in dtw_dict[label_name]:
-                for timeseries in filter(lambda ts: ts != references[label_name][dimension_id],
-                                         dtw_dict[label_name][dimension_id]):
-                    try:
-                        res = dtw_func(x=timeseries.data, y=references[label_name][dimension_id].data,
-                                       window_type="itakura")
-                        warping_path = res.get_warping_path(target="query")
-                        aligned_labels = aligned_labels.append(
-                            {"data": timeseries.data[warping_path].tolist(), "dimension_idx": dimension_id,
-                             "label_id": timeseries.id, "label_name": label_name, "reference": False},
-                            ignore_index=True)
-                    except ValueError:
-                        print(
-                            f"{timeseries.id} in dimension {dimension_id} for class {label_name} "
-                            f"\n is not able to be matched with the reference")
-                aligned_labels = aligned_labels.append(
-                    {"data": references[label_name][dimension_id].data.tolist(), "dimension_idx": dimension_id,
-                     "label_id": references[label_name][dimension_id].id, "label_name": label_name, "reference": True},
-                    ignore_index=True)
+        groups = []
+        for label_class in dtw_dict.keys():
+            for dimension_id, timeseries in dtw_dict[label_class].items():
+                timeseries = [ts for ts in timeseries if len(ts.data)]
+                if timeseries:
+                    groups.append(AlignmentGroup(key=(label_class, dimension_id), label_ids=[ts.id for ts in timeseries],
+                                                 series=[ts.data for ts in timeseries],
+                                                 reference=int(np.argmax([len(ts.data) for ts in timeseries]))))
+
+        # Align other labels with reference label, the groups are independent and aligned in parallel
+        align_groups(groups, n_workers=get_settings().DTW_ALIGN_WORKERS, progress=self.__send_alignment_progress)
+        for group in groups:
+            label_class, dimension_id = group.key
+            for idx, (label_id, data) in enumerate(zip(group.label_ids, group.series)):
+                if not group.matched[idx]:
+                    logging.getLogger("gideon").warning(f"{label_id} in dimension {dimension_id} for class {label_class} is not able to be matched with the reference")
+                    continue
+                aligned_labels.append({"data": group.aligned[idx], "dimension_idx": dimension_id, "label_id": label_id,
+                                       "label_class": label_class, "reference": idx == group.reference,
+                                       "length": len(data)})
 
         # Send Labels to Database
-        aligned_labels.to_sql(name=f"{self.project.id}_aligned_labels", con=engine, if_exists='replace')
+        label_template.upsert_aligned(db=self.session, project_id=self.project.id, rows=aligned_labels)
+        label_template.remove_aligned(db=self.session, project_id=self.project.id,
+                                      keep={row["label_id"] for row in aligned_labels})
+
+    def __send_alignment_progress(self, group: AlignmentGroup, done: int, total: int):
+        label_class, dimension_idx = group.key
+        update = AlignmentProgress(id=self.project.id, progress=round(done / total * 100, 2), label_class=label_class,
+                                   dimension_idx=dimension_idx)
+        redis_instance.publish(get_settings().INTEGRATION_PROGRESS_CHANNEL, json.dumps(jsonable_encoder(update)))
+
+    @staticmethod
+    def align_to_reference(data: np.ndarray, reference: np.ndarray) -> np.ndarray:
+        """ Warps a series onto the time axis of the reference"""
+        res = dtw_func(x=data, y=reference, window_type="itakura")
+        return data[res.get_warping_path(target="query")]
 
     def calculate_median_label(self):
-        """ Get all aligned labels for all label names from the database and calculate the median label"""
-
-        df = pd.read_sql(f""" SELECT * from "{self.project.id}_aligned_labels" """, con=engine)
-        median_labels_df = pd.DataFrame(columns=["label_name", "dimension_idx", "data"])
-
-        for label_name in set(df['label_name'].tolist()):
-            for dimension_idx in set(df['dimension_idx'].tolist()):
-                filtered_df = df[(df["dimension_idx"] == dimension_idx) & (df["label_name"] == label_name)]
-                ts = self.convert_db_column_string_to_tuple(result=filtered_df['data'])
-                array_ts = list(map(lambda x: np.array(x), ts))
-                median = np.median(array_ts, axis=0).tolist()
-                row = {"label_name": label_name, "dimension_idx": dimension_idx,
-                       "data": median}
-                median_labels_df = median_labels_df.append(row, ignore_index=True)
-
-        median_labels_df.to_sql(name=f"{self.project.id}_median_labels", con=engine, if_exists='replace')
-
-    def classify_label_for_new_sample(self, sample_id: int, window: PredictionWindow):
-        """ Classify a potential label"""
-        scores = []
-        df = pd.read_sql(f""" SELECT * from "{self.project.id}_aligned_labels" """, con=engine)
-        df["data"] = self.convert_db_column_string_to_tuple(df["data"])
-        sample = query_time_series_sample(project=self.project, sample=sample_id, connector=TimescaleDBConnectorPool())
-        for dimension in sample["sample"]:
-            ts = self.match_label_to_timestamps_and_values(timestamps=dimension["timestamps"],
-                                                           data=dimension["data"],
-                                                           label=window)
-            for label_id in set(df["label_id"].tolist()):
-                dimension_median = df.loc[(df["label_id"] == label_id) & (
-                        df["dimension_idx"] == dimension["id"]), "data"]
-                scores.append((dtw_measure(dimension_median, ts.data), label_id))
-        return min(scores, key=lambda x: x[0])[1]
+        """ Get all aligned labels for all label classes from the database and calculate the median label"""
+
+        label_template.remove_medians(db=self.session, project_id=self.project.id)
+        for label_class in labelClass.get_all(db=self.session, project_id=self.project.id):
+            for dimension_idx in range(1, self.project.dimensions + 1):
+                self.calculate_median_label_for(label_class=label_class.id, dimension_idx=dimension_idx)
+
+    def calculate_median_label_for(self, label_class: UUID, dimension_idx: int):
+        """ Calculate the median label of a single class and dimension"""
+        _, aligned = label_template.get_aligned(db=self.session, label_class=label_class, dimension_idx=dimension_idx)
+        if len({len(data) for data in aligned}) > 1:
+            # labels stored unaligned, refresh_stale realigns them before the median is used
+            label_template.mark_stale(db=self.session, project_id=self.project.id, label_class=label_class,
+                                      dimension_idx=dimension_idx)
+            return
+        if aligned:
+            label_template.upsert_median(db=self.session, project_id=self.project.id, label_class=label_class,
+                                         dimension_idx=dimension_idx, data=np.median(np.stack(aligned), axis=0))
+
+    def add_label(self, label: Label):
+        """ Aligns a new label to the references of its class, only the affected medians are recalculated"""
+        processing_label = self.__transform_label(label)
+        sample = self.samples.sample(processing_label.sample_id)
+        dimensions = range(1, self.project.dimensions + 1)
+        with label_template.alignment_lock((processing_label.label_class, dimension_idx) for dimension_idx in dimensions):
+            stale = set(label_template.get_stale(db=self.session, project_id=self.project.id))
+            aligned_labels = []
+            for dimension in sample["sample"]:
+                data = self.match_label_to_timestamps_and_values(timestamps=dimension["timestamps"], data=dimension["data"],
+                                                                 label=processing_label).data
+                if len(data) == 0:
+                    continue
+                key = (processing_label.label_class, dimension["id"])
+                row = {"dimension_idx": dimension["id"], "label_id": processing_label.label_id,
+                       "label_class": processing_label.label_class, "length": len(data)}
+                reference = label_template.get_reference(db=self.session, label_class=key[0], dimension_idx=key[1])
+                if reference is None:
+                    aligned_labels.append({**row, "data": data, "reference": True})
+                elif key in stale or len(data) > reference.length:
+                    # a longer label becomes the new reference, the class is realigned once its median is needed
+                    aligned_labels.append({**row, "data": data, "reference": False})
+                    stale.add(key)
+                    label_template.mark_stale(db=self.session, project_id=self.project.id, label_class=key[0],
+                                              dimension_idx=key[1])
+                else:
+                    try:
+                        aligned_labels.append({**row, "data": self.align_to_reference(data, from_blob(reference.data)),
+                                               "reference": False})
+                    except ValueError:
+                        logging.getLogger("gideon").warning(f"{processing_label.label_id} in dimension {key[1]} for class {key[0]} is not able to be matched with the reference")
+            label_template.upsert_aligned(db=self.session, project_id=self.project.id, rows=aligned_labels)
+            for row in aligned_labels:
+                if (row["label_class"], row["dimension_idx"]) not in stale:
+                    self.calculate_median_label_for(label_class=row["label_class"], dimension_idx=row["dimension_idx"])
 
     def update_label(self, label: Label):
         """ Update a previously existent label that was changed """
-        sample = query_time_series_sample(project=self.project, sample=1,
-                                          connector=TimescaleDBConnectorPool())
-        df = pd.read_sql(f""" SELECT * from "{self.project.id}_aligned_labels" """, con=engine)
-        for dimension in sample["sample"]:
-            processing_label = self.__transform_label(label)
-            matched_time_series = self.match_label_to_timestamps_and_values(timestamps=dimension["timestamps"],
-                                                                            data=dimension["data"],
-                                                                            label=processing_label)
-
-            df["data"] = self.convert_db_column_string_to_tuple(df["data"])
-            df.loc[(df["label_id"] == processing_label.label_id) & (
-                    df["dimension_idx"] == dimension["id"]), "data"] = matched_time_series
-        df.to_sql(name=f"{self.project.id}_aligned_labels", con=engine, if_exists='replace')
-        self.calculate_median_label()
+        previous = label_template.get_aligned_by_label(db=self.session, label_id=label.id)
+        label_template.remove_aligned_label(db=self.session, label_id=label.id)
+        if previous:
+            self.remove_labels(label_classes={previous[0].label_class})
+        self.add_label(label)
+
+    def remove_labels(self, label_classes: set[UUID]):
+        """ Updates the medians of classes whose labels were removed, a removed reference is replaced lazily"""
+        dimensions = range(1, self.project.dimensions + 1)
+        with label_template.alignment_lock((label_class, dimension_idx) for label_class in label_classes for dimension_idx in dimensions):
+            stale = set(label_template.get_stale(db=self.session, project_id=self.project.id))
+            for label_class in label_classes:
+                for dimension_idx in dimensions:
+                    if (label_class, dimension_idx) in stale:
+                        # holds labels that are not aligned to the reference yet, refresh_stale recalculates the median
+                        continue
+                    if label_template.get_reference(db=self.session, label_class=label_class, dimension_idx=dimension_idx):
+                        self.calculate_median_label_for(label_class=label_class, dimension_idx=dimension_idx)
+                        continue
+                    longest = label_template.get_longest(db=self.session, label_class=label_class, dimension_idx=dimension_idx)
+                    if longest is None:
+                        label_template.remove_median(db=self.session, label_class=label_class, dimension_idx=dimension_idx)
+                        continue
+                    label_template.set_reference(db=self.session, label_class=label_class, dimension_idx=dimension_idx,
+                                                 label_id=longest.label_id)
+                    label_template.mark_stale(db=self.session, project_id=self.project.id, label_class=label_class,
+                                              dimension_idx=dimension_idx)
+
+    def refresh_stale(self):
+        """ Realigns all classes whose reference changed since their median was calculated"""
+        self.realign(keys=label_template.get_stale(db=self.session, project_id=self.project.id))
+
+    def realign(self, keys: list[tuple[UUID, int]]):
+        """ Aligns all labels of each (class, dimension) to the longest label of the class, the groups are aligned in parallel"""
+        with label_template.alignment_lock(keys):
+            labels = self.__get_all_labels()
+            groups = []
+            for label_class, dimension_idx in keys:
+                series = []
+                for processing_label in labels:
+                    if processing_label.label_class != label_class:
+                        continue
+                    data = self.match_label_to_timestamps_and_values(
+                        timestamps=self.samples.js_timestamps(processing_label.sample_id - 1, dimension_idx - 1),
+                        data=self.samples.data(processing_label.sample_id - 1, dimension_idx - 1), label=processing_label).data
+                    if len(data):
+                        series.append((processing_label.label_id, data))
+                if not series:
+                    label_template.remove_median(db=self.session, label_class=label_class, dimension_idx=dimension_idx)
+                    continue
+                # same order as the longest label of the template store
+                series.sort(key=lambda item: (-len(item[1]), str(item[0])))
+                groups.append(AlignmentGroup(key=(label_class, dimension_idx), label_ids=[label_id for label_id, _ in series],
+                                             series=[data for _, data in series], reference=0))
+            if not groups:
+                return
+            align_groups(groups, n_workers=get_settings().DTW_ALIGN_WORKERS, progress=self.__send_alignment_progress)
+            for group in groups:
+                label_class, dimension_idx = group.key
+                aligned_labels = []
+                for idx, (label_id, data) in enumerate(zip(group.label_ids, group.series)):
+                    if not group.matched[idx]:
+                        logging.getLogger("gideon").warning(f"{label_id} in dimension {dimension_idx} for class {label_class} is not able to be matched with the reference")
+                        continue
+                    aligned_labels.append({"data": group.aligned[idx], "dimension_idx": dimension_idx, "label_id": label_id,
+                                           "label_class": label_class, "reference": idx == group.reference, "length": len(data)})
+                label_template.upsert_aligned(db=self.session, project_id=self.project.id, rows=aligned_labels)
+                # rows of labels that could not be matched would keep their unaligned length
+                label_template.remove_aligned_except(db=self.session, label_class=label_class, dimension_idx=dimension_idx,
+                                                     keep={row["label_id"] for row in aligned_labels})
+                self.calculate_median_label_for(label_class=label_class, dimension_idx=dimension_idx)
+
+
+def align_added_labels(project_id: UUID, label_ids: list[UUID]):
+    """ Background task for labels that were created"""
+    controller = DTW_Controller.for_project(project_id)
+    for label_id in label_ids:
+        controller.add_label(label.get(db=controller.session, uuid=label_id))
+    controller.session.close()
+
+
+def align_updated_label(project_id: UUID, label_id: UUID):
+    """ Background task for a label that was changed"""
+    controller = DTW_Controller.for_project(project_id)
+    controller.update_label(label.get(db=controller.session, uuid=label_id))
+    controller.session.close()
+
+
+def align_removed_labels(project_id: UUID, label_classes: set[UUID]):
+    """ Background task for labels that were deleted"""
+    controller = DTW_Controller.for_project(project_id)
+    controller.remove_labels(label_classes=label_classes)
+    controller.session.close()
+
+
+def search_windows(matrix: np.ndarray, windows: np.ndarray, references: list[Reference], radius: Optional[int]) -> tuple[np.ndarray, int]:
+    """
+    Index of the nearest reference for every window (sample_idx, start_idx, end_idx) and the number of pruned DTW computations
+    """
+    search = NearestReferenceSearch(references, radius)
+    nearest = np.empty(len(windows), dtype=np.int64)
+    pruned = 0
+    for window_idx, (sample_idx, start_idx, end_idx) in enumerate(windows):
+        result = search.search(matrix[sample_idx, :, start_idx:end_idx + 1])
+        nearest[window_idx] = result.index
+        pruned += result.pruned
+    return nearest, pruned
+
+
+class DTWClassifier:
+    """
+    Classifies prediction windows by their nearest median label.
+
+    The median labels are loaded once and kept as arrays, all windows of a prediction are scored in one pass that is
+    split across worker processes. Each window runs a lower bounded nearest reference search, the number of pruned
+    DTW computations is kept in pruned.
+    """
+
+    def __init__(self, project: Project):
+        self.project = project
+        self.label_classes = []
+        self.references = []
+        self.pruned = 0
+        self.computed = 0
+        controller = DTW_Controller(project=project)
+        # medians of classes with a new reference are realigned first
+        controller.refresh_stale()
+        medians = label_template.get_medians(db=controller.session, project_id=project.id)
+        controller.session.close()
+        for label_class, dimensions in medians.items():
+            self.label_classes.append(label_class)
+            self.references.append([(dimension_idx - 1, data) for dimension_idx, data in dimensions if len(data)])
 
+    def classify(self, samples: SampleStore, windows: np.ndarray) -> list[Optional[UUID]]:
+        """
+        Returns the label class of the nearest median label for every window (sample_idx, start_idx, end_idx)
+        """
+        if not self.references or len(windows) == 0:
+            return [None] * len(windows)
+        config = get_settings()
+        matrix = sample_matrix(samples)
+        chunks = np.array_split(windows, min(len(windows), effective_n_jobs(config.DTW_N_JOBS)))
+        results = Parallel(n_jobs=config.DTW_N_JOBS)(delayed(search_windows)(matrix, chunk, self.references, config.DTW_RADIUS) for chunk in chunks)
+        self.pruned = sum(pruned for _, pruned in results)
+        self.computed = len(windows) * len(self.references) - self.pruned
+        return [self.label_classes[idx] for idx in np.concatenate([nearest for nearest, _ in results])]
@@ -0,0 +1,148 @@
+import hashlib
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.db.sqlalchemy.database import engine
+from src.models.schemas.label_template import AlignedLabel, MedianLabel
+
+
+def to_blob(data: np.ndarray) -> bytes:
+    return np.ascontiguousarray(data, dtype='<f8').tobytes()
+
+
+def from_blob(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype='<f8')
+
+
+def advisory_key(label_class: UUID, dimension_idx: int) -> int:
+    """
+    Signed 64 bit advisory lock id of a class in a dimension
+    """
+    digest = hashlib.blake2b(f'aligned-label:{label_class}:{dimension_idx}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class LabelTemplateController:
+    """
+    Stores aligned labels and median labels of the label classes as float64 blobs.
+    Rows are upserted one label or class at a time, reads go straight into NumPy arrays.
+    """
+
+    @contextmanager
+    def alignment_lock(self, keys: Iterable[tuple[UUID, int]]) -> Iterator[None]:
+        """
+        Serializes the alignment of classes in dimensions across tasks and workers with Postgres advisory locks.
+        The locks are held by a connection of their own, so they outlive the commits made while aligning, and are
+        taken in a fixed order, so tasks locking several keys can not deadlock.
+        """
+        lock_ids = sorted({advisory_key(label_class, dimension_idx) for label_class, dimension_idx in keys})
+        with engine.connect() as connection:
+            try:
+                for lock_id in lock_ids:
+                    connection.execute(text("SELECT pg_advisory_lock(:id)"), {'id': lock_id})
+                yield
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock_all()"))
+
+    def upsert_aligned(self, db: Session, project_id: UUID, rows: list[dict]) -> None:
+        """
+        Inserts or replaces aligned labels, a row holds label_id, dimension_idx, label_class, reference, length and data
+        """
+        if not rows:
+            return
+        stmt = insert(AlignedLabel).values([{**row, 'project': project_id, 'data': to_blob(row['data'])} for row in rows])
+        stmt = stmt.on_conflict_do_update(index_elements=[AlignedLabel.label_id, AlignedLabel.dimension_idx],
+                                          set_={'label_class': stmt.excluded.label_class, 'reference': stmt.excluded.reference, 'length': stmt.excluded.length, 'data': stmt.excluded.data})
+        db.execute(stmt)
+        db.commit()
+
+    def get_aligned(self, db: Session, label_class: UUID, dimension_idx: int) -> tuple[list[UUID], list[np.ndarray]]:
+        """
+        Returns ids and data of all aligned labels of a class in a dimension
+        """
+        rows = db.query(AlignedLabel.label_id, AlignedLabel.data).filter(AlignedLabel.label_class == label_class, AlignedLabel.dimension_idx == dimension_idx).all()
+        return [row.label_id for row in rows], [from_blob(row.data) for row in rows]
+
+    def get_reference(self, db: Session, label_class: UUID, dimension_idx: int) -> Optional[AlignedLabel]:
+        return db.query(AlignedLabel).filter(AlignedLabel.label_class == label_class, AlignedLabel.dimension_idx == dimension_idx, AlignedLabel.reference.is_(True)).first()
+
+    def get_aligned_by_label(self, db: Session, label_id: UUID) -> list[AlignedLabel]:
+        return db.query(AlignedLabel).filter(AlignedLabel.label_id == label_id).all()
+
+    def get_longest(self, db: Session, label_class: UUID, dimension_idx: int) -> Optional[AlignedLabel]:
+        return db.query(AlignedLabel).filter(AlignedLabel.label_class == label_class, AlignedLabel.dimension_idx == dimension_idx).order_by(AlignedLabel.length.desc(), AlignedLabel.label_id).first()
+
+    def set_reference(self, db: Session, label_class: UUID, dimension_idx: int, label_id: UUID) -> None:
+        """
+        Makes a label the reference of a class in a dimension
+        """
+        db.query(AlignedLabel).filter(AlignedLabel.label_class == label_class, AlignedLabel.dimension_idx == dimension_idx).update({AlignedLabel.reference: AlignedLabel.label_id == label_id}, synchronize_session=False)
+        db.commit()
+
+    def remove_aligned_label(self, db: Session, label_id: UUID) -> None:
+        db.query(AlignedLabel).filter(AlignedLabel.label_id == label_id).delete(synchronize_session=False)
+        db.commit()
+
+    def remove_aligned(self, db: Session, project_id: UUID, keep: set[UUID]) -> None:
+        """
+        Removes the aligned labels of a project that are not in keep
+        """
+        db.query(AlignedLabel).filter(AlignedLabel.project == project_id, AlignedLabel.label_id.notin_(keep)).delete(synchronize_session=False)
+        db.commit()
+
+    def remove_aligned_except(self, db: Session, label_class: UUID, dimension_idx: int, keep: set[UUID]) -> None:
+        """
+        Removes the aligned labels of a class in a dimension that are not in keep
+        """
+        db.query(AlignedLabel).filter(AlignedLabel.label_class == label_class, AlignedLabel.dimension_idx == dimension_idx,
+                                      AlignedLabel.label_id.notin_(keep)).delete(synchronize_session=False)
+        db.commit()
+
+    def upsert_median(self, db: Session, project_id: UUID, label_class: UUID, dimension_idx: int, data: np.ndarray) -> None:
+        stmt = insert(MedianLabel).values(label_class=label_class, dimension_idx=dimension_idx, project=project_id, data=to_blob(data))
+        stmt = stmt.on_conflict_do_update(index_elements=[MedianLabel.label_class, MedianLabel.dimension_idx], set_={'data': stmt.excluded.data, 'stale': False})
+        db.execute(stmt)
+        db.commit()
+
+    def mark_stale(self, db: Session, project_id: UUID, label_class: UUID, dimension_idx: int) -> None:
+        """
+        Flags a median whose labels have to be realigned before it is used again
+        """
+        stmt = insert(MedianLabel).values(label_class=label_class, dimension_idx=dimension_idx, project=project_id, stale=True)
+        stmt = stmt.on_conflict_do_update(index_elements=[MedianLabel.label_class, MedianLabel.dimension_idx], set_={'stale': True})
+        db.execute(stmt)
+        db.commit()
+
+    def get_stale(self, db: Session, project_id: UUID) -> list[tuple[UUID, int]]:
+        rows = db.query(MedianLabel.label_class, MedianLabel.dimension_idx).filter(MedianLabel.project == project_id, MedianLabel.stale.is_(True)).all()
+        return [(row.label_class, row.dimension_idx) for row in rows]
+
+    def remove_median(self, db: Session, label_class: UUID, dimension_idx: int) -> None:
+        db.query(MedianLabel).filter(MedianLabel.label_class == label_class, MedianLabel.dimension_idx == dimension_idx).delete(synchronize_session=False)
+        db.commit()
+
+    def get_median(self, db: Session, label_class: UUID, dimension_idx: int) -> Optional[np.ndarray]:
+        row = db.query(MedianLabel.data).filter(MedianLabel.label_class == label_class, MedianLabel.dimension_idx == dimension_idx).first()
+        return from_blob(row.data) if row is not None and row.data is not None else None
+
+    def get_medians(self, db: Session, project_id: UUID) -> dict[UUID, list[tuple[int, np.ndarray]]]:
+        """
+        Returns the median labels of a project grouped by class as (dimension_idx, data)
+        """
+        medians = {}
+        for row in db.query(MedianLabel).filter(MedianLabel.project == project_id, MedianLabel.data.isnot(None)).order_by(MedianLabel.label_class, MedianLabel.dimension_idx):
+            medians.setdefault(row.label_class, []).append((row.dimension_idx, from_blob(row.data)))
+        return medians
+
+    def remove_medians(self, db: Session, project_id: UUID) -> None:
+        db.query(MedianLabel).filter(MedianLabel.project == project_id).delete(synchronize_session=False)
+        db.commit()
+
+
+label_template = LabelTemplateController()
@@ -1,23 +1,23 @@
+import logging
 import time
 from uuid import UUID
 
 import numpy as np
-import numpy.typing as npt
 from fastapi import HTTPException
 from sklearn.cluster import DBSCAN
 from sqlalchemy.orm import Session
-from tslearn.utils import to_sklearn_dataset
 
 from src.controllers import label_class_controller, project_controller, dtw_controller
 from src.controllers.cache_controller import cache
-from src.db.timescale_db.tsdb_connector import TimescaleDBConnector
+from src.controllers.util.windowing import sample_matrix, split_into_windows, window_bounds
+from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
 from src.models.models.label import Severity
 from src.models.models.prediction import Prediction, PredictionWindow, SamplePrediction, PredictionRequest, \
     PredictionAlgorithm
 
 
 def predict(project_uuid: UUID, prediction: PredictionRequest, db: Session,
-            connector: TimescaleDBConnector) -> Prediction:
+            connector: TimescaleDBConnectorPool) -> Prediction:
     x = time.time()
     samples = cache.read_from_cache(project_uuid)
     project = project_controller.project.get(db=db, uuid=project_uuid)
@@ -26,8 +26,12 @@ def predict(project_uuid: UUID, prediction: PredictionRequest, db: Session,
     print(f"sample retrieval time {time.time() - x}")
     if prediction.algorithm == PredictionAlgorithm.DBSCAN:
         window = round(prediction.params['window'])
+        step = round(prediction.params.get('step') or window)
         x = time.time()
-        windows = __split_into_windows(samples, window)
+        windows = split_into_windows(sample_matrix(samples), window, step)
+        # windows are placed by the timestamps of the first dimension
+        timestamps = sample_matrix(samples, timestamps=True)[:, 0]
+        starts, ends = window_bounds(timestamps.shape[-1], window, step)
         print(f"window time {time.time() - x}")
         x = time.time()
         algorithm = DBSCAN(eps=prediction.params['eps'])
@@ -35,25 +39,27 @@ def predict(project_uuid: UUID, prediction: PredictionRequest, db: Session,
         label_classes = label_class_controller.labelClass.get_all(db=db, project_id=project_uuid)
         normal = next((normal for normal in label_classes if normal.severity == Severity.okay), None)
         error = next((err for err in label_classes if err.severity == Severity.error), None)
+        classes_by_id = {label_class.id: label_class for label_class in label_classes}
+        # all windows of all samples are classified in one pass, ordered by sample and window
+        n_windows = len(starts)
+        dtw_windows = np.stack((np.repeat(np.arange(len(samples)), n_windows), np.tile(starts, len(samples)), np.tile(ends, len(samples))), axis=-1)
+        classifier = dtw_controller.DTWClassifier(project=project)
+        nearest_classes = classifier.classify(samples, dtw_windows)
+        logging.getLogger("gideon").debug(f"dtw computed {classifier.computed} pruned {classifier.pruned}")
         result = Prediction(model=prediction.algorithm, params=prediction.params)
         for idx, sample in enumerate(samples):
             sample_pred = SamplePrediction(sample=sample['id'])
             result.sample_predictions.append(sample_pred)
-            first_sample = sample['sample'][0]
             for pindx, prediction in enumerate(predictions):
                 val = prediction[idx]
                 if val == 0:
                     lbl_class = normal
                 else:
                     lbl_class = error
-                start = first_sample['timestamps'][pindx * window]
-                try:
-                    end = first_sample['timestamps'][pindx * window + window - 1]
-                except IndexError:
-                    end = first_sample['timestamps'][-1]
-                pred = PredictionWindow(start=start, end=end, labelClass=lbl_class)
-                label_pred = dtw_controller.DTW_Controller(project=project).classify_label_for_new_sample(window=pred, sample_id=sample["id"])
-                pred.labelClass = label_pred
+                pred = PredictionWindow(start=timestamps[idx, starts[pindx]], end=timestamps[idx, ends[pindx]], labelClass=lbl_class)
+                nearest_class = nearest_classes[idx * n_windows + pindx]
+                if nearest_class in classes_by_id:
+                    pred.labelClass = classes_by_id[nearest_class]
                 sample_pred.prediction.append(pred)
         runtime = time.time() - x
         print(f"Prediction Runtime {runtime}")
@@ -62,31 +68,7 @@ def predict(project_uuid: UUID, prediction: PredictionRequest, db: Session,
         raise HTTPException(status_code=400, detail="Unsupported algorithm.")
 
 
-def __split_into_windows(sample_list: list[dict], window_size: int) -> list[npt.ArrayLike]:
-    """
-    Returns a list of datasets, one for each sample window
-    """
-    sample_list_with_windows = []
-    window_dict = {}
-    window_datasets = []
-    for tsSample in sample_list:
-        data = list(map(lambda x: x['data'], tsSample['sample']))
-        dimensions_chunked = [[np.array(el[i:i + window_size]) for i in range(0, len(el), window_size)] for el in data]
-        sample_list_with_windows.append(dimensions_chunked)
-        n_windows = len(dimensions_chunked[0])
-    for window_idx in range(n_windows):
-        window_dict[f"window_{window_idx}"] = {}
-        for sample_idx, sample in enumerate(sample_list_with_windows):
-            window_dict[f"window_{window_idx}"][f"sample_{sample_idx}"] = []
-            for dimension in sample:
-                window_dict[f"window_{window_idx}"][f"sample_{sample_idx}"].append(dimension[window_idx])
-    for window in window_dict.keys():
-        window_datasets.append(to_sklearn_dataset(list(map(lambda x: np.array(x), window_dict[window].values()))))
-
-    return window_datasets
-
-
-def __perform_prediction(windows: list[npt.ArrayLike], algorithm) -> list[list[int]]:
+def __perform_prediction(windows: np.ndarray, algorithm) -> list[list[int]]:
     result = []
     for idx, window in enumerate(windows):
         clustering = algorithm.fit(window)
@@ -1,6 +1,6 @@
 import json
 import shutil
-from typing import Type
+from typing import Dict, Type
 from uuid import UUID
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -12,9 +12,10 @@ from src.config.settings import get_settings
 from src.controllers import label_class_controller
 from src.controllers.base_controller import ControllerBase
 from src.controllers.cache_controller import cache
-from src.controllers.util.file_processor import JsonFileProcessor, FileProcessor
+from src.controllers.util.file_processor import JsonFileProcessor, FileProcessor, CsvFileProcessor, ParquetFileProcessor, NumpyFileProcessor
 from src.controllers.util.file_util import get_temp_file
 from src.controllers.util.redis import redis_instance
+from src.controllers.util.sample_spool import SampleSpool
 from src.db.timescale_db.time_series_writer import TimeSeriesWriter
 from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
 from src.models.models.label import default_type
@@ -25,7 +26,7 @@ from src.models.shared.file_type import FileType
 
 class ProjectController(ControllerBase[Project, CreateProject, Project]):
 
-    def create(self, db: Session, connector: TimescaleDBConnectorPool, create: CreateProject) -> (Project, dict):
+    def create(self, db: Session, connector: TimescaleDBConnectorPool, create: CreateProject) -> (Project, SampleSpool):
 
         # check if file exists
         file = get_temp_file(create.file)
@@ -34,10 +35,10 @@ class ProjectController(ControllerBase[Project, CreateProject, Project]):
 
         # write ts data to db
         file_type = file.suffix
-        processor_type: Type[FileProcessor]
-        if file_type == FileType.json:
-            processor_type = JsonFileProcessor
-        else:
+        processors: Dict[str, Type[FileProcessor]] = {FileType.json: JsonFileProcessor, FileType.csv: CsvFileProcessor, FileType.parquet: ParquetFileProcessor,
+                                                      FileType.npy: NumpyFileProcessor, FileType.npz: NumpyFileProcessor}
+        processor_type = processors.get(file_type)
+        if processor_type is None:
             raise HTTPException(status_code=400, detail="Unsupported file type.")
         processor = processor_type(file=file, project=create)
         project_obj = processor.process()
@@ -54,12 +55,10 @@ class ProjectController(ControllerBase[Project, CreateProject, Project]):
         db.refresh(project_obj)
         return project_obj, processor.values
 
-    async def integrate_project(self, db: Session, connector: TimescaleDBConnectorPool, project_obj: Project, values: dict):
+    async def integrate_project(self, db: Session, connector: TimescaleDBConnectorPool, project_obj: Project, values: SampleSpool):
 
-        def send_progress_update_from_writer(id: UUID, writer: TimeSeriesWriter, increase: float):
-            p = writer.progress
-            writer.progress += increase
-            update = ProjectStatusUpdate(id=id, progress=round(p, 2), status=IntegrationStatus.integrating)
+        def send_progress_update_from_writer(id: UUID, writer: TimeSeriesWriter):
+            update = ProjectStatusUpdate(id=id, progress=round(writer.progress, 2), status=IntegrationStatus.integrating, rowsPerSecond=writer.rows_per_second)
             redis_instance.publish(get_settings().INTEGRATION_PROGRESS_CHANNEL, json.dumps(jsonable_encoder(update)))
 
         def send_progress_update(id: UUID, progress: int, status: IntegrationStatus):
@@ -69,9 +68,8 @@ class ProjectController(ControllerBase[Project, CreateProject, Project]):
         # write ts data
         try:
             writer = TimeSeriesWriter(connector=connector, project=project_obj)
-            increase = get_settings().DATA_PER_SECOND / writer.n_values
             scheduler = BackgroundScheduler()
-            job = scheduler.add_job(send_progress_update_from_writer, 'interval', args=[project_obj.id, writer, increase], seconds=1)
+            job = scheduler.add_job(send_progress_update_from_writer, 'interval', args=[project_obj.id, writer], seconds=1)
             scheduler.start()
             writer.write(values)
             job.remove()
@@ -85,6 +83,8 @@ class ProjectController(ControllerBase[Project, CreateProject, Project]):
             project_obj.status = IntegrationStatus.error
             db.add(project_obj)
             db.commit()
+        finally:
+            values.remove()
 
     def get_by_name(self, db: Session, name: str) -> Project:
         return db.query(self.model).filter(self.model.name == name).first()
@@ -0,0 +1,47 @@
+from uuid import UUID
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from src.config.settings import get_settings
+from src.controllers import project_controller
+from src.controllers.cache_controller import cache
+from src.controllers.util.dtw_search import dtw_distance
+from src.controllers.util.feature_index import window_features
+from src.controllers.util.windowing import sample_matrix
+from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
+from src.models.models.label import SimilarWindow
+
+
+def find_similar_windows(project_uuid: UUID, sample: int, start: int, end: int, k: int, db: Session,
+                         connector: TimescaleDBConnectorPool) -> list[SimilarWindow]:
+    """
+    Finds the k windows most similar to a segment of a sample. Candidates are retrieved from the feature index of the
+    project and re-ranked by their exact DTW distance, windows overlapping the segment itself are skipped.
+    """
+    project = project_controller.project.get_or_error(db=db, uuid=project_uuid)
+    index = cache.feature_index(project, connector)
+    samples = cache.read_from_cache(project_uuid)
+    if not 0 < sample <= samples.n_samples:
+        raise HTTPException(status_code=404, detail="Sample not found.")
+    sample_idx = sample - 1
+    # windows are placed by the timestamps of the first dimension
+    timestamps = sample_matrix(samples, timestamps=True)[:, 0]
+    start_idx = np.searchsorted(timestamps[sample_idx], start, side='left')
+    end_idx = np.searchsorted(timestamps[sample_idx], end, side='right') - 1
+    if end_idx < start_idx:
+        raise HTTPException(status_code=400, detail="Segment contains no values.")
+    matrix = sample_matrix(samples)
+    query = matrix[sample_idx, :, start_idx:end_idx + 1]
+    windows = index.windows
+    overlapping = (windows[:, 0] == sample_idx) & (windows[:, 1] <= end_idx) & (windows[:, 2] >= start_idx)
+    candidates = windows[index.nearest(window_features(query, index.paa_segments), k * get_settings().SIMILARITY_CANDIDATES, overlapping)]
+    radius = get_settings().DTW_RADIUS
+    distances = np.array([sum(dtw_distance(query[dimension_idx], matrix[window_sample, dimension_idx, window_start:window_end + 1], radius)
+                              for dimension_idx in range(matrix.shape[1])) for window_sample, window_start, window_end in candidates])
+    ranked = np.argsort(distances, kind='stable')[:k]
+    return [SimilarWindow(sample=int(candidates[idx, 0]) + 1,
+                          start=int(timestamps[candidates[idx, 0], candidates[idx, 1]]),
+                          end=int(timestamps[candidates[idx, 0], candidates[idx, 2]]),
+                          distance=float(distances[idx])) for idx in ranked]
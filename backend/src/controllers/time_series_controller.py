@@ -1,52 +1,121 @@
-from typing import List, Dict, Union
+import json
+from typing import List, Dict, Optional, Union
 from uuid import UUID
 
 from sqlalchemy.orm import Session
+from starlette.responses import Response, StreamingResponse
 
 from src.config.settings import get_settings
 from src.controllers import project_controller
-from src.db.timescale_db.time_series_reader import query_time_series, query_time_series_sample, query_time_series_sample_dimension, query_time_series_samples
-from src.db.timescale_db.time_series_reader_aggregator import query_time_series_agg, query_time_series_sample_agg, query_time_series_sample_dimension_agg
-from src.db.timescale_db.tsdb_connector_pool import TimescaleDBConnectorPool
+from src.controllers.util.time_series_frames import BINARY_MEDIA_TYPE, BINARY_STREAM_MEDIA_TYPE, NDJSON_MEDIA_TYPE, SeriesColumns, encode_frame, encode_prefixed_frame, \
+    to_json_sample, to_json_series
+from src.db.timescale_db.async_time_series_reader import query_time_series, query_time_series_sample, query_time_series_sample_dimension, query_time_series_samples
+from src.db.timescale_db.async_time_series_reader_aggregator import query_time_series_agg, query_time_series_sample_agg, query_time_series_sample_dimension_agg
+from src.db.timescale_db.async_time_series_reader_binary import query_time_series_binary, query_time_series_agg_binary, query_time_series_samples_binary, query_time_series_sample_binary, \
+    query_time_series_sample_agg_binary, query_time_series_sample_dimension_binary, query_time_series_sample_dimension_agg_binary
+from src.db.timescale_db.async_time_series_reader_pyramid import query_time_series_range, query_time_series_view
+from src.db.timescale_db.async_time_series_stream_reader import stream_time_series_samples
+from src.db.timescale_db.async_tsdb_connector_pool import AsyncTimescaleDBConnectorPool
 from src.models.models.time_series import TimeSeries, TimeSeriesProject, TimeSeriesSample
 
 
 class TimeSeriesController:
 
     @staticmethod
-    def query_time_series(uuid: UUID, db: Session, connector: TimescaleDBConnectorPool) -> TimeSeriesProject:
+    async def query_time_series(uuid: UUID, db: Session, connector: AsyncTimescaleDBConnectorPool, binary: bool = False) -> Union[TimeSeriesProject, Response]:
         """
         Queries the TimescaleDB to create TimeSeriesProject Object
         """
         project = project_controller.project.get_or_error(db=db, uuid=uuid)
         if (project.sampleLength * project.dimensions * project.samples) > get_settings().MAX_SAMPLES:
-            return query_time_series_agg(project=project, connector=connector)
-        return query_time_series(project=project, connector=connector)
+            if binary:
+                return TimeSeriesController.__frame_response(await query_time_series_agg_binary(project=project, connector=connector))
+            return await query_time_series_agg(project=project, connector=connector)
+        if binary:
+            return TimeSeriesController.__frame_response(await query_time_series_binary(project=project, connector=connector))
+        return await query_time_series(project=project, connector=connector)
 
     @staticmethod
-    def query_time_series_samples(uuid: UUID, db: Session, connector: TimescaleDBConnectorPool) -> List[dict]:
+    async def query_time_series_samples(uuid: UUID, db: Session, connector: AsyncTimescaleDBConnectorPool, binary: bool = False) -> Union[List[dict], Response]:
         """
         Query all samples for a project
         """
         project = project_controller.project.get_or_error(db=db, uuid=uuid)
-        return query_time_series_samples(project=project, connector=connector)
+        if binary:
+            return TimeSeriesController.__frame_response(await query_time_series_samples_binary(project=project, connector=connector))
+        return await query_time_series_samples(project=project, connector=connector)
 
     @staticmethod
-    def query_time_series_sample(uuid: UUID, sample: int, db: Session, connector: TimescaleDBConnectorPool) -> Union[Dict, TimeSeriesSample]:
+    def stream_time_series_samples(uuid: UUID, db: Session, connector: AsyncTimescaleDBConnectorPool, binary: bool = False) -> StreamingResponse:
         """
-           Queries a sample for a project.
+        Streams all samples for a project, one sample per NDJSON line or length-prefixed binary frame
         """
         project = project_controller.project.get_or_error(db=db, uuid=uuid)
+
+        async def ndjson():
+            async for sample in stream_time_series_samples(project=project, connector=connector):
+                yield json.dumps(to_json_sample(sample)) + "\n"
+
+        async def frames():
+            async for sample in stream_time_series_samples(project=project, connector=connector):
+                yield encode_prefixed_frame(sample)
+
+        if binary:
+            return StreamingResponse(frames(), media_type=BINARY_STREAM_MEDIA_TYPE)
+        return StreamingResponse(ndjson(), media_type=NDJSON_MEDIA_TYPE)
+
+    @staticmethod
+    async def query_time_series_sample(uuid: UUID, sample: int, db: Session, connector: AsyncTimescaleDBConnectorPool, binary: bool = False, start: Optional[float] = None,
+                                       end: Optional[float] = None, max_points: Optional[int] = None) -> Union[Dict, TimeSeriesSample, Response]:
+        """
+           Queries a sample for a project, optionally between start and end (epoch ms) with at most max_points points per dimension.
+        """
+        project = project_controller.project.get_or_error(db=db, uuid=uuid)
+        if start is not None or end is not None or max_points is not None:
+            series = await query_time_series_range(project=project, sample=sample, dimension=None, start=start, end=end, max_points=max_points, connector=connector)
+            if binary:
+                return TimeSeriesController.__frame_response(series)
+            return {'id': sample, 'sample': [to_json_series(s) for s in series]}
         if (project.sampleLength * project.dimensions) > get_settings().MAX_SAMPLES:
-            return query_time_series_sample_agg(project=project, sample=sample, connector=connector, max_samples=get_settings().MAX_SAMPLES)
-        return query_time_series_sample(project=project, sample=sample, connector=connector)
+            if binary:
+                return TimeSeriesController.__frame_response(await query_time_series_sample_agg_binary(project=project, sample=sample, connector=connector, max_samples=get_settings().MAX_SAMPLES))
+            return await query_time_series_sample_agg(project=project, sample=sample, connector=connector, max_samples=get_settings().MAX_SAMPLES)
+        if binary:
+            return TimeSeriesController.__frame_response(await query_time_series_sample_binary(project=project, sample=sample, connector=connector))
+        return await query_time_series_sample(project=project, sample=sample, connector=connector)
 
     @staticmethod
-    def query_time_series_sample_dimension(uuid: UUID, sample: int, dimension: int, db: Session, connector: TimescaleDBConnectorPool) -> TimeSeries:
+    async def query_time_series_sample_dimension(uuid: UUID, sample: int, dimension: int, db: Session, connector: AsyncTimescaleDBConnectorPool, binary: bool = False,
+                                                 start: Optional[float] = None, end: Optional[float] = None, max_points: Optional[int] = None) -> Union[TimeSeries, dict, Response]:
         """
-        Queries the timescale database for a single dimension of a timeseries
+        Queries the timescale database for a single dimension of a timeseries, optionally between start and end (epoch ms) with at most max_points points
         """
         project = project_controller.project.get_or_error(db=db, uuid=uuid)
+        if start is not None or end is not None or max_points is not None:
+            series = await query_time_series_range(project=project, sample=sample, dimension=dimension, start=start, end=end, max_points=max_points, connector=connector)
+            if binary:
+                return TimeSeriesController.__frame_response(series)
+            return to_json_series(series[0]) if series else {'id': dimension, 'data': [], 'timestamps': []}
         if project.sampleLength > get_settings().MAX_SAMPLES:
-            query_time_series_sample_dimension_agg(project=project, sample=sample, dimension=dimension, connector=connector, max_samples=get_settings().MAX_SAMPLES)
-        return query_time_series_sample_dimension(project=project, sample=sample, dimension=dimension, connector=connector)
+            if binary:
+                return TimeSeriesController.__frame_response(await query_time_series_sample_dimension_agg_binary(project=project, sample=sample, dimension=dimension, connector=connector, max_samples=get_settings().MAX_SAMPLES))
+            return await query_time_series_sample_dimension_agg(project=project, sample=sample, dimension=dimension, connector=connector, max_samples=get_settings().MAX_SAMPLES)
+        if binary:
+            return TimeSeriesController.__frame_response(await query_time_series_sample_dimension_binary(project=project, sample=sample, dimension=dimension, connector=connector))
+        return await query_time_series_sample_dimension(project=project, sample=sample, dimension=dimension, connector=connector)
+
+    @staticmethod
+    async def query_time_series_view(uuid: UUID, sample: int, dimension: int, start: Optional[float], end: Optional[float], pixel_width: int, db: Session,
+                                     connector: AsyncTimescaleDBConnectorPool, binary: bool = False) -> Union[dict, Response]:
+        """
+        Queries a sample dimension in a time range at the resolution needed for pixel_width points
+        """
+        project = project_controller.project.get_or_error(db=db, uuid=uuid)
+        series = await query_time_series_view(project=project, sample=sample, dimension=dimension, start=start, end=end, pixel_width=pixel_width, connector=connector)
+        if binary:
+            return TimeSeriesController.__frame_response(series)
+        return to_json_series(series[0]) if series else {'id': dimension, 'data': [], 'timestamps': []}
+
+    @staticmethod
+    def __frame_response(series: List[SeriesColumns]) -> Response:
+        return Response(content=encode_frame(series), media_type=BINARY_MEDIA_TYPE)
@@ -0,0 +1,125 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+from src.controllers.util.sample_spool import SampleSpool
+
+OUTPUT_COLUMNS = {'sample': np.int32, 'series': np.int32, 'timestamps': np.int64, 'values': np.float64}
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest triangle three buckets of all rows of y at once, x has shape (length,) or the shape of y.
+    Returns the indices of the selected points with shape (n_rows, n_out), buckets are split like in the lttb package.
+    """
+    n_rows, length = y.shape
+    if n_out >= length or length < 3:
+        return np.tile(np.arange(length), (n_rows, 1))
+    n_bins = max(n_out, 3) - 2
+    # times relative to the first point, the areas do not change but precision does
+    x = np.broadcast_to(x - (x[..., :1] if x.ndim > 1 else x[0]), y.shape).astype(np.float64)
+    sizes = np.full(n_bins, (length - 2) // n_bins, dtype=np.int64)
+    sizes[:(length - 2) % n_bins] += 1
+    edges = np.concatenate(([1], 1 + np.cumsum(sizes)))
+    # the centroid of the following bin, the last bin is followed by the last point
+    centroid_x, centroid_y = (np.concatenate((_bin_means(v, edges, sizes), v[:, -1:]), axis=1) for v in (x, y))
+    indices = np.empty((n_rows, n_bins + 2), dtype=np.int64)
+    indices[:, 0], indices[:, -1] = 0, length - 1
+    rows = np.arange(n_rows)
+    ax, ay = x[:, 0], y[:, 0]
+    for i in range(n_bins):
+        bx, by = x[:, edges[i]:edges[i + 1]], y[:, edges[i]:edges[i + 1]]
+        areas = np.abs((ax - centroid_x[:, i])[:, None] * (by - ay[:, None]) - (ax[:, None] - bx) * (centroid_y[:, i] - ay)[:, None])
+        indices[:, i + 1] = edges[i] + np.argmax(areas, axis=1)
+        ax, ay = x[rows, indices[:, i + 1]], y[rows, indices[:, i + 1]]
+    return indices
+
+
+def _bin_means(values: np.ndarray, edges: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """
+    Means of all bins but the first, the last point does not belong to a bin
+    """
+    if len(sizes) < 2:
+        return np.zeros((len(values), 0))
+    return np.add.reduceat(values[:, :-1], edges[1:-1], axis=1) / sizes[1:]
+
+
+def output_lengths(lengths: np.ndarray, factor: float) -> np.ndarray:
+    """
+    Number of points kept per series of the given lengths
+    """
+    return np.minimum(lengths, np.maximum(np.ceil(factor * lengths), 3)).astype(np.int64)
+
+
+def _downsample_range(path: Path, start: int, stop: int, factor: float, names: Dict[str, str], n_rows: int, offset: int) -> None:
+    """
+    Downsamples a range of spooled samples into the shared output columns, starting at offset.
+    Samples of equal length are stacked, so every bucket step of lttb covers all of their series at once.
+    """
+    spool = SampleSpool(path)
+    n_dimensions = spool.n_dimensions
+    blocks = {name: shared_memory.SharedMemory(name=block) for name, block in names.items()}
+    try:
+        output = {name: np.ndarray((n_rows,), dtype=OUTPUT_COLUMNS[name], buffer=block.buf) for name, block in blocks.items()}
+        lengths = spool.index[start:stop, 1]
+        n_out = output_lengths(lengths, factor)
+        offsets = offset + np.concatenate(([0], np.cumsum(n_out * n_dimensions)[:-1])).astype(np.int64)
+        for length in np.unique(lengths):
+            group = np.flatnonzero(lengths == length)
+            samples = [spool.sample(start + int(idx)) for idx in group]
+            # one row per (sample, dimension)
+            microseconds = np.repeat(np.stack([timestamps for timestamps, _ in samples]).astype(np.int64), n_dimensions, axis=0)
+            values = np.concatenate([sample_values for _, sample_values in samples])
+            indices = lttb_indices(microseconds, values, int(n_out[group[0]]))
+            selected_timestamps = np.take_along_axis(microseconds, indices, axis=1)
+            selected_values = np.take_along_axis(values, indices, axis=1)
+            n_points = indices.shape[1]
+            for position, idx in enumerate(group):
+                rows = slice(position * n_dimensions, (position + 1) * n_dimensions)
+                begin = int(offsets[idx])
+                end = begin + n_dimensions * n_points
+                output['sample'][begin:end] = start + idx
+                output['series'][begin:end] = np.repeat(np.arange(n_dimensions), n_points)
+                output['timestamps'][begin:end] = selected_timestamps[rows].ravel()
+                output['values'][begin:end] = selected_values[rows].ravel()
+    finally:
+        # the views have to be released before the shared memory can be closed
+        output = None
+        for block in blocks.values():
+            block.close()
+
+
+@contextmanager
+def downsample_spool(spool: SampleSpool, factor: float, max_rows: int, n_workers: Optional[int] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Downsamples every (sample, dimension) of a spool with lttb to about factor of its points.
+    Batches of samples are downsampled in a process pool, the workers read the memory mapped spool and write into
+    shared output columns, so neither input nor result are pickled. Yields the columns sample, series, timestamps
+    (datetime64) and values ordered by sample, series and time, they are only valid within the context.
+    """
+    lengths = output_lengths(spool.index[:, 1], factor) * spool.n_dimensions
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    n_rows = int(offsets[-1])
+    blocks = {name: shared_memory.SharedMemory(create=True, size=max(n_rows * np.dtype(dtype).itemsize, 1)) for name, dtype in OUTPUT_COLUMNS.items()}
+    output = {}
+    try:
+        names = {name: block.name for name, block in blocks.items()}
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_downsample_range, spool.path, samples.start, samples.stop, factor, names, n_rows, int(offsets[samples.start]))
+                       for samples in spool.batches(max_rows) if len(samples)]
+            for future in futures:
+                future.result()
+        output.update({name: np.ndarray((n_rows,), dtype=dtype, buffer=blocks[name].buf) for name, dtype in OUTPUT_COLUMNS.items()})
+        output['timestamps'] = output['timestamps'].view('datetime64[us]')
+        yield output
+    finally:
+        # the views have to be released before the shared memory can be closed
+        output.clear()
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
@@ -0,0 +1,130 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from tslearn.metrics import dtw as dtw_measure
+
+# a reference is a list of (dimension_idx, series), its distance is the sum over its dimensions
+Reference = List[Tuple[int, np.ndarray]]
+# keeps rounding errors of the bounds from pruning references with the same distance as the best one
+BOUND_TOLERANCE = 1e-9
+
+
+@dataclass
+class SearchResult:
+    index: int
+    distance: float
+    pruned: int
+
+
+def dtw_distance(query: np.ndarray, reference: np.ndarray, radius: Optional[int] = None) -> float:
+    """
+    DTW distance, constrained to a Sakoe-Chiba band if a radius is given
+    """
+    if radius is None:
+        return dtw_measure(query, reference)
+    return dtw_measure(query, reference, global_constraint="sakoe_chiba", sakoe_chiba_radius=radius)
+
+
+def band_bounds(query_length: int, reference_length: int, radius: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    First and last reference index every query index may be matched with, same band as tslearn's sakoe_chiba_mask.
+    Without a radius the band spans the whole reference.
+    """
+    rows = np.arange(query_length)
+    if radius is None:
+        return np.zeros(query_length, dtype=np.int64), np.full(query_length, reference_length - 1, dtype=np.int64)
+    if query_length <= reference_length:
+        lower = np.maximum(rows - radius, 0)
+        upper = np.minimum(rows + reference_length - query_length + radius, reference_length - 1)
+    else:
+        lower = np.maximum(rows - (query_length - reference_length + radius), 0)
+        upper = np.minimum(rows + radius, reference_length - 1)
+    return lower, upper
+
+
+def envelope(reference: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Minimum and maximum of the reference between lower and upper (inclusive) for every query index,
+    answered from a sparse table in O(n log n)
+    """
+    mins, maxs = [reference], [reference]
+    while 2 ** len(mins) <= len(reference):
+        half = 2 ** (len(mins) - 1)
+        mins.append(np.minimum(mins[-1][:-half], mins[-1][half:]))
+        maxs.append(np.maximum(maxs[-1][:-half], maxs[-1][half:]))
+    levels = np.floor(np.log2(upper - lower + 1)).astype(np.int64)
+    env_min = np.empty(len(lower))
+    env_max = np.empty(len(lower))
+    for level in np.unique(levels):
+        rows = levels == level
+        left, right = lower[rows], upper[rows] - 2 ** level + 1
+        env_min[rows] = np.minimum(mins[level][left], mins[level][right])
+        env_max[rows] = np.maximum(maxs[level][left], maxs[level][right])
+    return env_min, env_max
+
+
+def lb_kim(query: np.ndarray, reference: np.ndarray) -> float:
+    """
+    Squared lower bound from the first and last points, which every warping path has to match
+    """
+    first = (query[0] - reference[0]) ** 2
+    if len(query) == 1 and len(reference) == 1:
+        return first
+    last = (query[-1] - reference[-1]) ** 2
+    if len(query) == 1 or len(reference) == 1:
+        return max(first, last)
+    return first + last
+
+
+def lb_keogh(query: np.ndarray, env_min: np.ndarray, env_max: np.ndarray) -> float:
+    """
+    Squared lower bound from the distance of every query point to the envelope of the reference
+    """
+    return float(np.sum(np.square(query - np.clip(query, env_min, env_max))))
+
+
+class NearestReferenceSearch:
+    """
+    Finds the reference with the smallest DTW distance to a query.
+
+    References are visited in order of their lower bound (LB_Kim, then LB_Keogh within the Sakoe-Chiba band) and the
+    full DTW is only computed while the lower bound does not exceed the best distance so far. The bounds are exact,
+    so the result equals an exhaustive search with the same band.
+    """
+
+    def __init__(self, references: List[Reference], radius: Optional[int] = None):
+        self.references = references
+        self.radius = radius
+        self._envelopes: Dict[Tuple[int, int, int], Tuple[np.ndarray, np.ndarray]] = {}
+
+    def search(self, query: np.ndarray) -> SearchResult:
+        """
+        Searches the nearest reference for a query of shape (n_dimensions, length)
+        """
+        bounds = np.array([self.__lower_bound(query, ref_idx, reference) for ref_idx, reference in enumerate(self.references)])
+        best_idx, best = -1, np.inf
+        computed = 0
+        for ref_idx in np.argsort(bounds, kind='stable'):
+            # references are sorted by their bound, none of the remaining ones can be closer
+            if bounds[ref_idx] > best + BOUND_TOLERANCE * (1 + best):
+                break
+            distance = sum(dtw_distance(query[dimension_idx], data, self.radius) for dimension_idx, data in self.references[ref_idx])
+            computed += 1
+            if distance < best or (distance == best and ref_idx < best_idx):
+                best_idx, best = ref_idx, distance
+        return SearchResult(index=int(best_idx), distance=float(best), pruned=len(self.references) - computed)
+
+    def __lower_bound(self, query: np.ndarray, ref_idx: int, reference: Reference) -> float:
+        """
+        Lower bound of the distance summed over the dimensions
+        """
+        bound = 0.0
+        for dimension_idx, data in reference:
+            series = query[dimension_idx]
+            kim = lb_kim(series, data)
+            key = (ref_idx, dimension_idx, len(series))
+            if key not in self._envelopes:
+                self._envelopes[key] = envelope(data, *band_bounds(len(series), len(data), self.radius))
+            bound += np.sqrt(max(kim, lb_keogh(series, *self._envelopes[key])))
+        return bound
@@ -0,0 +1,112 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from src.controllers.util.sample_store import SampleStore
+from src.controllers.util.windowing import sample_matrix, split_into_windows, window_bounds, window_count
+
+# mean, std, min, max and slope followed by the piecewise aggregate approximation
+N_SUMMARY_FEATURES = 5
+
+
+def window_features(windows: np.ndarray, paa_segments: int) -> np.ndarray:
+    """
+    Summary features of windows with shape (..., length), returns shape (..., 5 + paa_segments).
+    The slope is fitted over a time axis scaled to [0, 1], so windows of different length are comparable.
+    """
+    length = windows.shape[-1]
+    mean = windows.mean(axis=-1)
+    time = np.linspace(0, 1, length) if length > 1 else np.zeros(1)
+    centered = time - time.mean()
+    denominator = np.square(centered).sum()
+    slope = ((windows - mean[..., None]) * centered).sum(axis=-1) / denominator if denominator else np.zeros_like(mean)
+    # segment averages, the segments split the window as evenly as possible
+    bounds = np.linspace(0, length, paa_segments + 1).astype(np.int64)
+    sums = np.concatenate((np.zeros(windows.shape[:-1] + (1,)), np.cumsum(windows, axis=-1)), axis=-1)
+    counts = np.maximum(bounds[1:] - bounds[:-1], 1)
+    paa = (sums[..., bounds[1:]] - sums[..., bounds[:-1]]) / counts
+    return np.concatenate((np.stack((mean, windows.std(axis=-1), windows.min(axis=-1), windows.max(axis=-1), slope), axis=-1), paa), axis=-1)
+
+
+class FeatureIndex:
+    """
+    Summary features of all windows of a project, stored as memory mapped arrays next to the cached samples.
+
+    Every window of every sample gets one feature row per dimension. The features are standardized per column, so
+    the euclidean distance between rows weighs all features alike and can be used to retrieve similar windows.
+    """
+    features_file = 'features.npy'
+    windows_file = 'windows.npy'
+    scale_file = 'scale.npy'
+    chunk_samples = 256
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.features = np.load(path.joinpath(self.features_file), mmap_mode='r')
+        self.windows = np.load(path.joinpath(self.windows_file), mmap_mode='r')
+        self.scale = np.load(path.joinpath(self.scale_file))
+
+    @classmethod
+    def exists(cls, path: Path) -> bool:
+        return path.joinpath(cls.scale_file).is_file()
+
+    @property
+    def paa_segments(self) -> int:
+        return self.features.shape[-1] - N_SUMMARY_FEATURES
+
+    def standardize(self, features: np.ndarray) -> np.ndarray:
+        return (features - self.scale[0]) / self.scale[1]
+
+    def nearest(self, features: np.ndarray, k: int, exclude: np.ndarray = None) -> np.ndarray:
+        """
+        Indices of the k windows closest to the features of a query with shape (n_dimensions, n_features)
+        """
+        distances = np.sqrt(np.square(self.features - self.standardize(features)).sum(axis=-1)).sum(axis=-1)
+        if exclude is not None:
+            distances[exclude] = np.inf
+        k = min(k, int(np.isfinite(distances).sum()))
+        candidates = np.argpartition(distances, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+        return candidates[np.argsort(distances[candidates], kind='stable')]
+
+    @classmethod
+    def write(cls, path: Path, samples: SampleStore, window: int, step: int, paa_segments: int) -> 'FeatureIndex':
+        """
+        Computes the features of all (sample, dimension, window), windows are stored as (sample_idx, start_idx, end_idx)
+        """
+        values = sample_matrix(samples)
+        n_samples, n_dimensions, length = values.shape
+        window = min(window, max(length, 1))
+        step = min(step, window)
+        n_windows = window_count(length, window, step)
+        features = np.empty((n_samples, n_windows, n_dimensions, N_SUMMARY_FEATURES + paa_segments))
+        # samples are processed in chunks to bound the memory of the windowed copy
+        for first in range(0, n_samples, cls.chunk_samples):
+            chunk = values[first:first + cls.chunk_samples]
+            windows = split_into_windows(chunk, window, step).reshape((n_windows, len(chunk), n_dimensions, window))
+            features[first:first + len(chunk)] = window_features(windows.swapaxes(0, 1), paa_segments)
+        features = features.reshape((n_samples * n_windows, n_dimensions, -1))
+        flat = features.reshape((-1, features.shape[-1]))
+        scale = np.stack((flat.mean(axis=0), flat.std(axis=0))) if len(flat) else np.zeros((2, features.shape[-1]))
+        scale[1][scale[1] == 0] = 1
+        starts, ends = window_bounds(length, window, step)
+        bounds = np.stack((np.repeat(np.arange(n_samples), n_windows), np.tile(starts, n_samples), np.tile(ends, n_samples)), axis=-1)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        tmp.mkdir(parents=True, exist_ok=True)
+        np.save(tmp.joinpath(cls.features_file), ((features - scale[0]) / scale[1]).astype(np.float32))
+        np.save(tmp.joinpath(cls.windows_file), bounds.astype(np.int64))
+        np.save(tmp.joinpath(cls.scale_file), scale)
+        stale = path.with_name(f'{path.name}.{os.getpid()}.stale')
+        try:
+            os.replace(path, stale)
+            shutil.rmtree(stale, ignore_errors=True)
+        except FileNotFoundError:
+            # no previous index, or another worker moved it away
+            pass
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # another worker moved its index in place first, both are built from the same store
+            shutil.rmtree(tmp, ignore_errors=True)
+        return cls(path)
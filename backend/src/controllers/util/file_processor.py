@@ -1,43 +1,183 @@
-import json
+import zipfile
 from abc import ABC, abstractmethod
-from datetime import datetime
 from pathlib import Path
+from typing import Iterator
 
+import ijson
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from fastapi import HTTPException
+
+from src.config.settings import get_settings
+from src.controllers.util.sample_spool import SampleSpool
+from src.controllers.util.time_util import parse_iso_timestamps
 from src.models.models.project import CreateProject
 from src.models.schemas import Project
 
 
 class FileProcessor(ABC):
+    """
+    Reads an uploaded file into a SampleSpool, which is handed to the TimeSeriesWriter afterwards
+    """
 
     def __init__(self, file: Path, project: CreateProject):
         self.file = file
-        self.values = dict()
+        # samples are spooled next to the upload folder, which is removed once the file is processed
+        self.values = SampleSpool.create(file.parent.with_name(f'{file.parent.name}.spool'))
         self.project = project
 
     @abstractmethod
-    def get_data_from_file(self) -> Project:
+    def spool_samples(self) -> None:
+        """
+        Appends all samples of the file to the spool
+        """
         pass
 
+    def get_data_from_file(self) -> Project:
+        self.spool_samples()
+        self.values.close()
+        if not len(self.values):
+            raise HTTPException(status_code=400, detail="File contains no samples.")
+        first_timestamps, _ = self.values.sample(0)
+        last_timestamps, _ = self.values.sample(len(self.values) - 1)
+        sample_time = (last_timestamps[-1] - last_timestamps[0]) / np.timedelta64(1, 's') if len(last_timestamps) else 0
+        return Project(name=self.project.name, samples=len(self.values), dimensions=self.values.n_dimensions, hasTimestamps=True,
+                       sampleLength=len(first_timestamps), sampleTime=float(sample_time))
+
     def process(self) -> Project:
-        project_obj = self.get_data_from_file()
-        return project_obj
+        try:
+            return self.get_data_from_file()
+        except Exception:
+            self.values.remove()
+            raise
 
 
 class JsonFileProcessor(FileProcessor):
-    def get_data_from_file(self) -> Project:
-        f = open(self.file)
-        file = json.load(f)
-        first_sample = next(iter(file[0]))
-        sample_length = len(file[0][first_sample])
-        samples = len(file)
-        # -1 because we do not count the time dimension
-        dimensions = len(file[0]) - 1
-        for sample_idx, sample in enumerate(file):
-            self.values[sample_idx] = {}
-            for dimension_idx, dimension in enumerate(filter(lambda x: x != 'time', list(sample.keys()))):
-                self.values[sample_idx][dimension_idx] = []
-                for ts_idx, value in enumerate(sample[dimension]):
-                    self.values[sample_idx][dimension_idx].append(
-                        (datetime.fromisoformat(sample["time"][ts_idx]), sample_idx, dimension_idx, value))
-        sample_time = datetime.fromisoformat(file[-1]["time"][-1]) - datetime.fromisoformat(file[-1]["time"][0])
-        return Project(name=self.project.name, samples=samples, dimensions=dimensions, hasTimestamps=True, sampleLength=sample_length, sampleTime=sample_time.total_seconds())
+    """
+    Reads a list of samples, every sample maps "time" and each dimension to a list of values.
+    The file is parsed incrementally, so only one sample is held in memory at a time.
+    """
+
+    def spool_samples(self) -> None:
+        dimensions = None
+        with open(self.file, 'rb') as f:
+            for sample in ijson.items(f, 'item', use_float=True):
+                keys = [key for key in sample.keys() if key != 'time']
+                if dimensions is None:
+                    dimensions = keys
+                elif keys != dimensions:
+                    raise HTTPException(status_code=400, detail=f"Sample {len(self.values)} has different dimensions.")
+                timestamps = parse_iso_timestamps(sample['time'])
+                self.values.append(timestamps, np.array([sample[key] for key in keys], dtype=np.float64).reshape((len(keys), len(timestamps))))
+
+
+class ColumnarFileProcessor(FileProcessor, ABC):
+    """
+    Reads tables with one row per timestamp, a "sample" column, a "time" column and one column per dimension.
+    Rows of a sample have to be consecutive, without a sample column the whole table is a single sample.
+    The table is read in chunks and a sample is spooled as soon as its last row was read.
+    """
+    sample_column = 'sample'
+    time_column = 'time'
+
+    @abstractmethod
+    def read_chunks(self) -> Iterator[pd.DataFrame]:
+        pass
+
+    def chunk_rows(self, n_columns: int) -> int:
+        return max(get_settings().INGEST_BATCH_ROWS // max(n_columns, 1), 1)
+
+    def spool_samples(self) -> None:
+        dimensions = None
+        pending, pending_id, spooled = [], None, set()
+        for chunk in self.read_chunks():
+            if dimensions is None:
+                if self.time_column not in chunk.columns:
+                    raise HTTPException(status_code=400, detail=f"Missing column {self.time_column}.")
+                dimensions = [column for column in chunk.columns if column not in (self.sample_column, self.time_column)]
+            if not len(chunk):
+                continue
+            sample_ids = chunk[self.sample_column].to_numpy() if self.sample_column in chunk.columns else np.zeros(len(chunk), dtype=np.int64)
+            starts = np.flatnonzero(np.concatenate(([True], sample_ids[1:] != sample_ids[:-1])))
+            for start, end in zip(starts, np.append(starts[1:], len(chunk))):
+                if pending and sample_ids[start] == pending_id:
+                    pending.append(chunk.iloc[start:end])
+                    continue
+                if pending:
+                    self.__append(pd.concat(pending), dimensions)
+                    spooled.add(pending_id)
+                if sample_ids[start] in spooled:
+                    raise HTTPException(status_code=400, detail=f"Rows of sample {sample_ids[start]} are not consecutive.")
+                pending, pending_id = [chunk.iloc[start:end]], sample_ids[start]
+        if pending:
+            self.__append(pd.concat(pending), dimensions)
+
+    def __append(self, frame: pd.DataFrame, dimensions: list):
+        timestamps = pd.to_datetime(frame[self.time_column])
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert(None)
+        self.values.append(timestamps.to_numpy().astype('datetime64[us]'), frame[dimensions].to_numpy(dtype=np.float64).T)
+
+
+class CsvFileProcessor(ColumnarFileProcessor):
+
+    def read_chunks(self) -> Iterator[pd.DataFrame]:
+        header = pd.read_csv(self.file, nrows=0)
+        yield from pd.read_csv(self.file, chunksize=self.chunk_rows(len(header.columns)), engine='c')
+
+
+class ParquetFileProcessor(ColumnarFileProcessor):
+
+    def read_chunks(self) -> Iterator[pd.DataFrame]:
+        parquet = pq.ParquetFile(self.file)
+        for batch in parquet.iter_batches(batch_size=self.chunk_rows(len(parquet.schema_arrow.names))):
+            yield batch.to_pandas()
+
+
+class NumpyFileProcessor(FileProcessor):
+    """
+    Reads an array of shape (samples, dimensions, length), or (samples, length) for a single dimension.
+    A .npz archive holds the array as "values" and optionally "time" with shape (length,) or (samples, length),
+    as datetime64 or epoch seconds. Without timestamps the values are one second apart.
+    Arrays are memory mapped, so only the sample being spooled is read.
+    """
+
+    def spool_samples(self) -> None:
+        if self.file.suffix == '.npz':
+            values, timestamps = self.__member('values'), self.__member('time')
+        else:
+            values, timestamps = np.load(self.file, mmap_mode='r'), None
+        if values is None or values.ndim not in (2, 3):
+            raise HTTPException(status_code=400, detail="Expected values of shape (samples, dimensions, length).")
+        if values.ndim == 2:
+            values = values[:, None, :]
+        if timestamps is None:
+            timestamps = np.arange(values.shape[-1], dtype=np.int64).astype('datetime64[s]')
+        elif timestamps.dtype.kind != 'M':
+            timestamps = np.round(np.asarray(timestamps, dtype=np.float64) * 1e6).astype(np.int64).astype('datetime64[us]')
+        if timestamps.shape[-1] != values.shape[-1]:
+            raise HTTPException(status_code=400, detail="Timestamps and values differ in length.")
+        for sample_idx, sample in enumerate(values):
+            self.values.append(timestamps if timestamps.ndim == 1 else timestamps[sample_idx], sample)
+
+    def __member(self, name: str):
+        """
+        Memory maps an uncompressed member of the archive, compressed members are loaded
+        """
+        with zipfile.ZipFile(self.file) as archive:
+            if f'{name}.npy' not in archive.namelist():
+                return None
+            info = archive.getinfo(f'{name}.npy')
+            if info.compress_type != zipfile.ZIP_STORED:
+                return np.load(archive.open(info))
+        with open(self.file, 'rb') as f:
+            # the data starts after the local file header, whose name and extra field lengths are stored at offset 26
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            read_header = np.lib.format.read_array_header_1_0 if np.lib.format.read_magic(f)[0] == 1 else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            if dtype.hasobject:
+                raise HTTPException(status_code=400, detail="Object arrays are not supported.")
+            return np.memmap(self.file, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C')
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def overlapping_labels(window_samples: np.ndarray, window_starts: np.ndarray, window_ends: np.ndarray,
+                       label_samples: np.ndarray, label_starts: np.ndarray, label_ends: np.ndarray) -> np.ndarray:
+    """
+    Joins labels to the windows they overlap within the same sample, bounds are inclusive.
+    Windows have to be ordered by sample and start with non decreasing ends per sample. Returns for every window the
+    index of the last label overlapping it, or -1 if no label does.
+    """
+    owner = np.full(len(window_samples), -1, dtype=np.int64)
+    if len(window_samples) == 0 or len(label_samples) == 0:
+        return owner
+    # timestamps are replaced by their rank, so every sample gets its own range of keys without overflowing
+    timestamps, ranks = np.unique(np.concatenate((window_starts, window_ends, label_starts, label_ends)), return_inverse=True)
+    n_windows, n_labels = len(window_samples), len(label_samples)
+    samples, sample_ranks = np.unique(np.concatenate((window_samples, label_samples)), return_inverse=True)
+    offset = sample_ranks.astype(np.int64) * len(timestamps)
+    window_start_keys = offset[:n_windows] + ranks[:n_windows]
+    window_end_keys = offset[:n_windows] + ranks[n_windows:2 * n_windows]
+    label_start_keys = offset[n_windows:] + ranks[2 * n_windows:2 * n_windows + n_labels]
+    label_end_keys = offset[n_windows:] + ranks[2 * n_windows + n_labels:]
+    # windows between the first one ending after the label start and the last one starting before the label end
+    first = np.searchsorted(window_end_keys, label_start_keys, side='left')
+    last = np.searchsorted(window_start_keys, label_end_keys, side='right')
+    counts = np.maximum(last - first, 0)
+    label_idx = np.repeat(np.arange(n_labels), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - first, counts)
+    np.maximum.at(owner, positions, label_idx)
+    return owner
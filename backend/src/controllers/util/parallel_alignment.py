@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+from dtwalign import dtw as dtw_func
+
+
+@dataclass
+class AlignmentGroup:
+    """
+    Labels of one class in one dimension, all series are aligned to the series at reference
+    """
+    key: Any
+    label_ids: List[Any]
+    series: List[np.ndarray]
+    reference: int
+    aligned: Optional[np.ndarray] = None
+    matched: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=bool))
+
+
+def _align_group(input_name: str, input_size: int, output_name: str, output_size: int, offsets: np.ndarray,
+                 lengths: np.ndarray, reference: int, output_offset: int) -> np.ndarray:
+    """
+    Aligns the series of a group with the Itakura window, the results are written into the shared output buffer
+    """
+    shm_in = shared_memory.SharedMemory(name=input_name)
+    shm_out = shared_memory.SharedMemory(name=output_name)
+    try:
+        values = np.ndarray((input_size,), dtype=np.float64, buffer=shm_in.buf)
+        output = np.ndarray((output_size,), dtype=np.float64, buffer=shm_out.buf)
+        return _align_into(values, output, offsets, lengths, reference, output_offset)
+    finally:
+        # the views have to be released before the shared memory can be closed
+        values = output = None
+        shm_in.close()
+        shm_out.close()
+
+
+def _align_into(values: np.ndarray, output: np.ndarray, offsets: np.ndarray, lengths: np.ndarray, reference: int,
+                output_offset: int) -> np.ndarray:
+    reference_data = values[offsets[reference]:offsets[reference] + lengths[reference]]
+    aligned = output[output_offset:output_offset + len(offsets) * len(reference_data)].reshape((len(offsets), len(reference_data)))
+    matched = np.zeros(len(offsets), dtype=bool)
+    for idx, (offset, length) in enumerate(zip(offsets, lengths)):
+        data = values[offset:offset + length]
+        if idx == reference:
+            aligned[idx] = data
+            matched[idx] = True
+            continue
+        try:
+            warping_path = dtw_func(x=data, y=reference_data, window_type="itakura").get_warping_path(target="query")
+            aligned[idx] = data[warping_path]
+            matched[idx] = True
+        except ValueError:
+            # not matchable within the window
+            pass
+    return matched
+
+
+def align_groups(groups: List[AlignmentGroup], n_workers: Optional[int] = None,
+                 progress: Optional[Callable[[AlignmentGroup, int, int], None]] = None) -> List[AlignmentGroup]:
+    """
+    Aligns independent groups in a process pool.
+    All series are passed in one shared memory block and every group writes into its slice of a preallocated shared
+    output, so only offsets travel between the processes. progress is called with the group and the number of
+    finished and total groups whenever a group is done.
+    """
+    lengths = [np.array([len(series) for series in group.series], dtype=np.int64) for group in groups]
+    input_offsets = np.concatenate(([0], np.cumsum([length.sum() for length in lengths]))).astype(np.int64)
+    output_sizes = [len(length) * length[group.reference] if len(length) else 0 for group, length in zip(groups, lengths)]
+    output_offsets = np.concatenate(([0], np.cumsum(output_sizes))).astype(np.int64)
+    input_size, output_size = int(input_offsets[-1]), int(output_offsets[-1])
+    shm_in = shared_memory.SharedMemory(create=True, size=max(input_size * 8, 1))
+    shm_out = shared_memory.SharedMemory(create=True, size=max(output_size * 8, 1))
+    try:
+        values = np.ndarray((input_size,), dtype=np.float64, buffer=shm_in.buf)
+        output = np.ndarray((output_size,), dtype=np.float64, buffer=shm_out.buf)
+        for group, offset in zip(groups, input_offsets):
+            if group.series:
+                values[offset:offset + sum(len(series) for series in group.series)] = np.concatenate(group.series)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(_align_group, shm_in.name, input_size, shm_out.name, output_size,
+                                       input_offsets[idx] + np.concatenate(([0], np.cumsum(lengths[idx])[:-1])).astype(np.int64),
+                                       lengths[idx], group.reference, int(output_offsets[idx])): idx
+                       for idx, group in enumerate(groups) if group.series}
+            for done, future in enumerate(as_completed(futures), start=1):
+                group = groups[futures[future]]
+                group.matched = future.result()
+                if progress is not None:
+                    progress(group, done, len(futures))
+        for idx, group in enumerate(groups):
+            if group.series:
+                reference_length = lengths[idx][group.reference]
+                group.aligned = output[output_offsets[idx]:output_offsets[idx + 1]].reshape((len(group.series), reference_length)).copy()
+        return groups
+    finally:
+        values = output = None
+        shm_in.close()
+        shm_in.unlink()
+        shm_out.close()
+        shm_out.unlink()
@@ -0,0 +1,143 @@
+"""
+    Multi resolution pyramid of a project
+
+    Level 0 is the raw data, every further level aggregates factor buckets of the level below into their minimum,
+    maximum and average, starting at the timestamp of the first point of the bucket. Levels are built per
+    (sample, dimension) until a level has at most min_points buckets. The extent of every series is kept, so a view
+    can pick its level from the requested time range without counting rows.
+"""
+from typing import Dict, Iterator
+
+import numpy as np
+
+from src.controllers.util.sample_spool import SampleSpool
+from src.controllers.util.time_series_frames import SeriesColumns
+
+
+def sample_pyramid(timestamps: np.ndarray, values: np.ndarray, factor: int, min_points: int) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Levels of a sample with timestamps (length,) and values (n_dimensions, length), starting at level 1.
+    Yields the columns level, series, ts, min_value, max_value and avg_value ordered by series and time.
+    """
+    n_dimensions, length = values.shape
+    mins, maxs, sums, counts = values, values, values, np.ones(length, dtype=np.int64)
+    level = 0
+    while len(timestamps) > min_points:
+        level += 1
+        starts = np.arange(0, len(timestamps), factor)
+        mins = np.minimum.reduceat(mins, starts, axis=1)
+        maxs = np.maximum.reduceat(maxs, starts, axis=1)
+        sums = np.add.reduceat(sums, starts, axis=1)
+        counts = np.add.reduceat(counts, starts)
+        timestamps = timestamps[starts]
+        n_buckets = len(starts)
+        yield {'level': np.full(n_dimensions * n_buckets, level, dtype=np.int32),
+               'timeseries_id': np.repeat(np.arange(n_dimensions, dtype=np.int32), n_buckets),
+               'ts': np.tile(timestamps, n_dimensions),
+               'min_value': mins.ravel(),
+               'max_value': maxs.ravel(),
+               'avg_value': (sums / counts).ravel()}
+
+
+def pyramid_levels(length: int, factor: int, min_points: int) -> int:
+    """
+    Number of levels above the raw data built for a series of the given length
+    """
+    levels = 0
+    while length > min_points:
+        length = -(-length // factor)
+        levels += 1
+    return levels
+
+
+def spool_pyramid(spool: SampleSpool, samples: range, factor: int, min_points: int) -> Dict[str, np.ndarray]:
+    """
+    All levels of a range of spooled samples as columns of the pyramid table
+    """
+    columns = []
+    for sample_idx in samples:
+        timestamps, values = spool.sample(sample_idx)
+        for level in sample_pyramid(timestamps, values, factor, min_points):
+            level['sample_id'] = np.full(len(level['ts']), sample_idx, dtype=np.int32)
+            columns.append(level)
+    names = ['level', 'sample_id', 'timeseries_id', 'ts', 'min_value', 'max_value', 'avg_value']
+    if not columns:
+        return {name: np.zeros(0, dtype='datetime64[us]' if name == 'ts' else np.float64) for name in names}
+    return {name: np.concatenate([level[name] for level in columns]) for name in names}
+
+
+def spool_extents(spool: SampleSpool, factor: int, min_points: int) -> Dict[str, np.ndarray]:
+    """
+    First and last timestamp, number of points and levels of every (sample, dimension)
+    """
+    offsets, lengths = spool.index[:, 0], spool.index[:, 1]
+    filled = lengths > 0
+    first = np.zeros(len(lengths), dtype='datetime64[us]')
+    last = np.zeros(len(lengths), dtype='datetime64[us]')
+    first[filled] = spool.timestamps[offsets[filled]]
+    last[filled] = spool.timestamps[offsets[filled] + lengths[filled] - 1]
+    levels = np.array([pyramid_levels(int(length), factor, min_points) for length in lengths], dtype=np.int32)
+    n_dimensions = spool.n_dimensions
+    return {'sample_id': np.repeat(np.arange(len(lengths), dtype=np.int32), n_dimensions),
+            'timeseries_id': np.tile(np.arange(n_dimensions, dtype=np.int32), len(lengths)),
+            'first_ts': np.repeat(first, n_dimensions),
+            'last_ts': np.repeat(last, n_dimensions),
+            'n_values': np.repeat(lengths, n_dimensions).astype(np.int64),
+            'levels': np.repeat(levels, n_dimensions)}
+
+
+def estimated_points(n_values: int, first: float, last: float, start: float, end: float) -> float:
+    """
+    Raw points of a series between start and end, assuming evenly spaced points
+    """
+    if last > first:
+        return n_values * max(min(end, last) - max(start, first), 0) / (last - first)
+    return n_values if start <= first <= end else 0
+
+
+def bucket_width(n_values: int, first: float, last: float, level: int, factor: int) -> float:
+    """
+    Time covered by a bucket of a level, assuming evenly spaced points
+    """
+    return (last - first) / max(n_values - 1, 1) * factor ** level
+
+
+def choose_level(n_values: int, first: float, last: float, levels: int, start: float, end: float, pixel_width: int, factor: int) -> int:
+    """
+    The coarsest level that still has at least pixel_width points between start and end, 0 is the raw data.
+    All times are in the same unit.
+    """
+    points = estimated_points(n_values, first, last, start, end)
+    level = 0
+    while level < levels and points / factor ** (level + 1) >= pixel_width:
+        level += 1
+    return level
+
+
+def level_within(n_values: int, first: float, last: float, levels: int, start: float, end: float, max_points: int, factor: int) -> int:
+    """
+    The finest level that has at most max_points points between start and end, or the coarsest level if none has
+    """
+    points = estimated_points(n_values, first, last, start, end)
+    level = 0
+    while level < levels and points / factor ** level > max_points:
+        level += 1
+    return level
+
+
+def merge_buckets(series: SeriesColumns, max_points: int) -> SeriesColumns:
+    """
+    Merges consecutive points or buckets of a series until it has at most max_points buckets
+    """
+    n_points = len(series.timestamps)
+    if n_points <= max_points:
+        return series
+    starts = np.arange(0, n_points, -(-n_points // max_points))
+    counts = np.diff(np.append(starts, n_points))
+    data_min = series.data if series.data_min is None else series.data_min
+    # data_max holds the range above data_min
+    data_max = series.data if series.data_max is None else series.data_min + series.data_max
+    mins = np.minimum.reduceat(data_min, starts)
+    return SeriesColumns(sample=series.sample, id=series.id, timestamps=series.timestamps[starts],
+                         data=np.add.reduceat(series.data, starts) / counts,
+                         data_min=mins, data_max=np.maximum.reduceat(data_max, starts) - mins)
@@ -0,0 +1,137 @@
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+
+class SampleSpool:
+    """
+    On disk buffer between parsing an uploaded file and writing it to the database.
+
+    Samples are appended one at a time, timestamps (datetime64[us]) and values (float64, dimension major) are written
+    to two flat files and the index holds offset and length of every sample. Once closed, the spool is read back
+    through memory maps, so neither the parser nor the writer hold more than a bounded part of a project in memory.
+    """
+    timestamps_file = 'timestamps.bin'
+    values_file = 'values.bin'
+    index_file = 'index.npy'
+
+    def __init__(self, path: Path, n_dimensions: int = None):
+        self.path = path
+        self.n_dimensions = n_dimensions
+        self._index = []
+        self._length = 0
+        self._timestamps_out = self._values_out = None
+        self.timestamps = self.values = self.index = None
+        if self.exists(path):
+            self.__open()
+
+    @classmethod
+    def exists(cls, path: Path) -> bool:
+        return path.joinpath(cls.index_file).is_file()
+
+    @classmethod
+    def create(cls, path: Path) -> 'SampleSpool':
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        spool = cls(path)
+        spool._timestamps_out = open(path.joinpath(cls.timestamps_file), 'wb')
+        spool._values_out = open(path.joinpath(cls.values_file), 'wb')
+        return spool
+
+    def append(self, timestamps: np.ndarray, values: np.ndarray) -> None:
+        """
+        Appends a sample with timestamps of shape (length,) and values of shape (n_dimensions, length)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self.n_dimensions is None:
+            self.n_dimensions = values.shape[0]
+        if values.shape != (self.n_dimensions, len(timestamps)):
+            raise ValueError(f"Sample {len(self._index)} has shape {values.shape}, expected ({self.n_dimensions}, {len(timestamps)}).")
+        self._timestamps_out.write(np.ascontiguousarray(timestamps, dtype='datetime64[us]').tobytes())
+        self._values_out.write(np.ascontiguousarray(values).tobytes())
+        self._index.append((self._length, len(timestamps)))
+        self._length += len(timestamps)
+
+    def close(self) -> 'SampleSpool':
+        """
+        Finishes writing, the spool is readable afterwards
+        """
+        self._timestamps_out.close()
+        self._values_out.close()
+        self._timestamps_out = self._values_out = None
+        index = np.array(self._index, dtype=np.int64).reshape((-1, 2))
+        # the number of dimensions is kept as last row, so an empty spool still knows it
+        np.save(self.path.joinpath(self.index_file), np.concatenate((index, [[self.n_dimensions or 0, 0]])))
+        self.__open()
+        return self
+
+    def __open(self):
+        index = np.load(self.path.joinpath(self.index_file))
+        self.index, self.n_dimensions = index[:-1], int(index[-1, 0])
+        n_values = int(self.index[:, 1].sum())
+        self.timestamps = self.__map(self.timestamps_file, 'datetime64[us]', (n_values,))
+        self.values = self.__map(self.values_file, np.float64, (n_values * self.n_dimensions,))
+
+    def __map(self, name: str, dtype, shape: tuple) -> np.ndarray:
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.path.joinpath(name), dtype=dtype, mode='r', shape=shape)
+
+    @property
+    def n_samples(self) -> int:
+        return len(self.index) if self.index is not None else len(self._index)
+
+    @property
+    def n_values(self) -> int:
+        """ Number of data points over all samples and dimensions """
+        return int(self.index[:, 1].sum()) * self.n_dimensions
+
+    def __len__(self) -> int:
+        return self.n_samples
+
+    def sample(self, sample_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Timestamps (length,) and values (n_dimensions, length) of a sample as views of the spool
+        """
+        offset, length = self.index[sample_idx]
+        values = self.values[offset * self.n_dimensions:(offset + length) * self.n_dimensions]
+        return self.timestamps[offset:offset + length], values.reshape((self.n_dimensions, length))
+
+    def columns(self, samples: range) -> Dict[str, np.ndarray]:
+        """
+        Columns sample, series, timestamps and values of a range of samples, ordered by sample, series and time
+        """
+        index = self.index[samples.start:samples.stop]
+        lengths = index[:, 1]
+        start, end = (int(index[0, 0]), int(index[-1].sum())) if len(index) else (0, 0)
+        # every timestamp of a sample is repeated once per dimension
+        timestamps = [np.tile(self.timestamps[offset:offset + length], self.n_dimensions) for offset, length in index]
+        return {'sample': np.repeat(np.arange(samples.start, samples.stop, dtype=np.int32), lengths * self.n_dimensions),
+                'series': np.repeat(np.tile(np.arange(self.n_dimensions, dtype=np.int32), len(index)), np.repeat(lengths, self.n_dimensions)),
+                'timestamps': np.concatenate(timestamps) if timestamps else np.zeros(0, dtype='datetime64[us]'),
+                'values': np.asarray(self.values[start * self.n_dimensions:end * self.n_dimensions])}
+
+    def batches(self, max_rows: int) -> Iterator[range]:
+        """
+        Splits the samples into consecutive ranges of at most max_rows data points, larger samples form a batch of their own
+        """
+        first, rows = 0, 0
+        for sample_idx, (_, length) in enumerate(self.index):
+            sample_rows = int(length) * self.n_dimensions
+            if rows and rows + sample_rows > max_rows:
+                yield range(first, sample_idx)
+                first, rows = sample_idx, 0
+            rows += sample_rows
+        if first < self.n_samples:
+            yield range(first, self.n_samples)
+
+    def remove(self) -> None:
+        for out in (self._timestamps_out, self._values_out):
+            if out is not None:
+                out.close()
+        self._timestamps_out = self._values_out = None
+        self.timestamps = self.values = None
+        shutil.rmtree(self.path, ignore_errors=True)
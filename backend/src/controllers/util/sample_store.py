@@ -0,0 +1,84 @@
+import os
+import shutil
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+
+class SampleStore:
+    """
+    Memory mapped cache of a project.
+
+    All values (float64) and js timestamps (int64) of a project are stored in two contiguous arrays ordered by
+    sample, dimension and time. The index holds offset and length of every (sample, dimension), so reading a
+    sample or dimension returns zero-copy views and opening a project does not depend on its size.
+    """
+    values_file = 'values.npy'
+    timestamps_file = 'timestamps.npy'
+    index_file = 'index.npy'
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.values = np.load(path.joinpath(self.values_file), mmap_mode='r')
+        self.timestamps = np.load(path.joinpath(self.timestamps_file), mmap_mode='r')
+        self.index = np.load(path.joinpath(self.index_file), mmap_mode='r')
+
+    @classmethod
+    def exists(cls, path: Path) -> bool:
+        return path.joinpath(cls.index_file).is_file()
+
+    @property
+    def n_samples(self) -> int:
+        return self.index.shape[0]
+
+    @property
+    def n_dimensions(self) -> int:
+        return self.index.shape[1]
+
+    def data(self, sample_idx: int, dimension_idx: int) -> np.ndarray:
+        offset, length = self.index[sample_idx, dimension_idx]
+        return self.values[offset:offset + length]
+
+    def js_timestamps(self, sample_idx: int, dimension_idx: int) -> np.ndarray:
+        offset, length = self.index[sample_idx, dimension_idx]
+        return self.timestamps[offset:offset + length]
+
+    def sample(self, sample_id: int) -> dict:
+        """
+        Returns a sample in the structure of the sample endpoints, sample_id starts at 1
+        """
+        sample_idx = sample_id - 1
+        return {'id': sample_id,
+                'sample': [{'id': dimension_idx + 1,
+                            'data': self.data(sample_idx, dimension_idx),
+                            'timestamps': self.js_timestamps(sample_idx, dimension_idx)}
+                           for dimension_idx in range(self.n_dimensions)]}
+
+    def __len__(self) -> int:
+        return self.n_samples
+
+    def __iter__(self) -> Iterator[dict]:
+        for sample_idx in range(self.n_samples):
+            yield self.sample(sample_idx + 1)
+
+    @classmethod
+    def write(cls, path: Path, samples: np.ndarray, series: np.ndarray, timestamps: np.ndarray, values: np.ndarray, n_samples: int, n_dimensions: int) -> 'SampleStore':
+        """
+        Writes a project to disk, the columns have to be ordered by sample, series and timestamp.
+        The store is written next to its target and moved in place afterwards, so readers never see partial files.
+        """
+        counts = np.bincount(samples.astype(np.int64) * n_dimensions + series, minlength=n_samples * n_dimensions)[:n_samples * n_dimensions]
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        index = np.stack((offsets, counts), axis=-1).reshape((n_samples, n_dimensions, 2)).astype(np.int64)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        tmp.mkdir(parents=True, exist_ok=True)
+        np.save(tmp.joinpath(cls.values_file), np.ascontiguousarray(values, dtype=np.float64))
+        np.save(tmp.joinpath(cls.timestamps_file), np.ascontiguousarray(timestamps, dtype=np.int64))
+        np.save(tmp.joinpath(cls.index_file), index)
+        if path.exists():
+            stale = path.with_name(f'{path.name}.{os.getpid()}.stale')
+            os.replace(path, stale)
+            shutil.rmtree(stale, ignore_errors=True)
+        os.replace(tmp, path)
+        return cls(path)
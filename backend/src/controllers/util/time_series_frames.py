@@ -0,0 +1,120 @@
+"""
+    Binary columnar wire format for time series
+
+    All values are little-endian and every array starts at an 8 byte aligned offset, so clients can map them
+    directly onto typed arrays (e.g. Float64Array / BigInt64Array).
+
+    Frame header (8 bytes):    char[4] magic "GTS1", uint32 series_count
+    Series header (16 bytes):  int32 sample, int32 series, uint32 point_count, uint32 flags
+    Series body:               int64 timestamps[point_count] (epoch ms), float64 data[point_count]
+                               if flags & 1: float64 data_min[point_count], float64 data_max[point_count]
+
+    data_max has the same meaning as in the JSON responses, i.e. the range above data_min.
+
+    Streamed responses are a sequence of frames, one per sample, each prefixed with its uint32 byte length
+    and 4 bytes of padding, so the arrays of every frame stay 8 byte aligned.
+"""
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BINARY_MEDIA_TYPE = "application/vnd.gideon.timeseries"
+BINARY_STREAM_MEDIA_TYPE = "application/vnd.gideon.timeseries-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+FRAME_MAGIC = b"GTS1"
+FLAG_MIN_MAX = 1
+
+_frame_header = struct.Struct('<4sI')
+_series_header = struct.Struct('<iiII')
+_frame_length = struct.Struct('<I4x')
+
+
+@dataclass
+class SeriesColumns:
+    sample: int
+    id: int
+    timestamps: np.ndarray
+    data: np.ndarray
+    data_min: Optional[np.ndarray] = None
+    data_max: Optional[np.ndarray] = None
+
+
+def accepts_binary(accept: Optional[str]) -> bool:
+    """
+    Checks whether the client asked for the binary format, JSON stays the default
+    """
+    return accept is not None and BINARY_MEDIA_TYPE in accept
+
+
+def split_series(columns: Dict[str, np.ndarray]) -> List[SeriesColumns]:
+    """
+    Splits columns ordered by sample and series into one SeriesColumns per (sample, series)
+    """
+    sample, series = columns['sample'], columns['series']
+    if len(sample) == 0:
+        return []
+    boundaries = np.flatnonzero((np.diff(sample) != 0) | (np.diff(series) != 0)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(sample)]))
+    has_range = 'data_min' in columns
+    return [SeriesColumns(sample=int(sample[start]),
+                          id=int(series[start]),
+                          timestamps=columns['timestamps'][start:end],
+                          data=columns['data'][start:end],
+                          data_min=columns['data_min'][start:end] if has_range else None,
+                          data_max=columns['data_max'][start:end] if has_range else None)
+            for start, end in zip(starts, ends)]
+
+
+def encode_frame(series: List[SeriesColumns]) -> bytes:
+    """
+    Encodes a list of series into a single binary frame
+    """
+    parts = [_frame_header.pack(FRAME_MAGIC, len(series))]
+    for s in series:
+        has_range = s.data_min is not None
+        parts.append(_series_header.pack(s.sample, s.id, len(s.timestamps), FLAG_MIN_MAX if has_range else 0))
+        parts.append(np.ascontiguousarray(s.timestamps, dtype='<i8').tobytes())
+        parts.append(np.ascontiguousarray(s.data, dtype='<f8').tobytes())
+        if has_range:
+            parts.append(np.ascontiguousarray(s.data_min, dtype='<f8').tobytes())
+            parts.append(np.ascontiguousarray(s.data_max, dtype='<f8').tobytes())
+    return b"".join(parts)
+
+
+def encode_prefixed_frame(series: List[SeriesColumns]) -> bytes:
+    """
+    Encodes a list of series into a length-prefixed frame for streamed responses
+    """
+    frame = encode_frame(series)
+    return _frame_length.pack(len(frame)) + frame
+
+
+def _json_values(array: np.ndarray) -> list:
+    values = array.tolist()
+    if np.isnan(array).any():
+        values = [None if value != value else value for value in values]
+    return values
+
+
+def to_json_sample(series: List[SeriesColumns]) -> dict:
+    """
+    Converts the series of one sample into the JSON structure of the sample endpoints
+    """
+    return {
+        'id': series[0].sample,
+        'sample': [{'id': s.id, 'data': _json_values(s.data), 'timestamps': s.timestamps.tolist()} for s in series]
+    }
+
+
+def to_json_series(series: SeriesColumns) -> dict:
+    """
+    Converts a series into the JSON structure of the dimension endpoints, data_min and data_max are only set for aggregates
+    """
+    result = {'id': series.id, 'data': _json_values(series.data), 'timestamps': series.timestamps.tolist()}
+    if series.data_min is not None:
+        result['data_min'] = _json_values(series.data_min)
+        result['data_max'] = _json_values(series.data_max)
+    return result
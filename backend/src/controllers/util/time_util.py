@@ -1,14 +1,22 @@
-import datetime
 import datetime as dt
-import pytz
+from typing import Sequence
+
+import numpy as np
 
 
 def current_time():
     return dt.datetime.now().strftime("%H:%M:%S")
 
 
-def time_string_to_js_timestamp(time: datetime) -> int:
-    # js need * 1000 because of different standards
-    timezone = pytz.timezone("UTC")
-    return round(timezone.localize(time).timestamp() * 1000)
+def parse_iso_timestamps(times: Sequence[str]) -> np.ndarray:
+    """
+    Parses ISO 8601 strings into datetime64[us] in one vectorized call
+    """
+    return np.asarray(times, dtype='datetime64[us]')
+
 
+def to_js_timestamps(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Converts datetime64 values to js timestamps, i.e. rounded epoch milliseconds of the UTC times
+    """
+    return np.round(timestamps.astype('datetime64[us]').astype(np.int64) / 1000).astype(np.int64)
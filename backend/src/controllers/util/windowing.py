@@ -0,0 +1,62 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src.controllers.util.sample_store import SampleStore
+
+
+def sample_matrix(samples: SampleStore, timestamps: bool = False) -> np.ndarray:
+    """
+    Returns the values (or js timestamps) of all samples as array of shape (n_samples, n_dimensions, length).
+    Equally long series are a zero-copy view of the store, shorter series are padded with their last value.
+    """
+    column = samples.timestamps if timestamps else samples.values
+    lengths = samples.index[..., 1]
+    length = int(lengths.max()) if lengths.size else 0
+    if np.all(lengths == length):
+        return column[:lengths.size * length].reshape((samples.n_samples, samples.n_dimensions, length))
+    matrix = np.empty((samples.n_samples, samples.n_dimensions, length), dtype=column.dtype)
+    for sample_idx in range(samples.n_samples):
+        for dimension_idx in range(samples.n_dimensions):
+            offset, count = samples.index[sample_idx, dimension_idx]
+            series = column[offset:offset + count]
+            matrix[sample_idx, dimension_idx, :count] = series
+            matrix[sample_idx, dimension_idx, count:] = series[-1] if count else np.nan
+    return matrix
+
+
+def window_count(length: int, window: int, step: Optional[int] = None) -> int:
+    """
+    Number of windows needed to cover a series, the last window may reach past its end
+    """
+    step = step or window
+    return -(-max(length - window, 0) // step) + 1
+
+
+def window_bounds(length: int, window: int, step: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the first and last index of every window, clipped to the series
+    """
+    step = step or window
+    starts = np.arange(window_count(length, window, step)) * step
+    return starts, np.minimum(starts + window, length) - 1
+
+
+def split_into_windows(matrix: np.ndarray, window: int, step: Optional[int] = None) -> np.ndarray:
+    """
+    Splits an array of shape (n_samples, n_dimensions, length) into windows.
+    Returns one dataset per window with shape (n_windows, n_samples, n_dimensions * window), the dimensions of a
+    sample are concatenated. Windows are tumbling by default and sliding if step < window, a window reaching past
+    the end of a series is padded with its last value.
+    """
+    step = step or window
+    n_samples, n_dimensions, length = matrix.shape
+    n_windows = window_count(length, window, step)
+    padding = (n_windows - 1) * step + window - length
+    if length == 0:
+        matrix = np.full((n_samples, n_dimensions, window), np.nan)
+    elif padding > 0:
+        matrix = np.pad(matrix, ((0, 0), (0, 0), (0, padding)), mode='edge')
+    views = sliding_window_view(matrix, window, axis=-1)[:, :, ::step]
+    return np.moveaxis(views, 2, 0).reshape((n_windows, n_samples, n_dimensions * window))
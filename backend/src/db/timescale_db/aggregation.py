@@ -0,0 +1,52 @@
+from src.config.settings import get_settings
+from src.models.models.project import ProjectDB
+
+
+def aggregate_interval(project: ProjectDB) -> float:
+    """
+    Bucket width in seconds of the continuous aggregate of a project
+    """
+    data_points = project.sampleLength * project.dimensions * project.samples
+    coeff = data_points / (get_settings().MAX_SAMPLES / 100)
+    time_delta = project.sampleTime / project.sampleLength
+    return coeff * time_delta
+
+
+def dimension_interval(project: ProjectDB, max_samples: int) -> float:
+    """
+    Bucket width in seconds of single dimension views of samples longer than max_samples
+    """
+    return round(project.sampleTime / (project.sampleLength / max_samples), 0)
+
+
+def has_dimension_aggregate(project: ProjectDB) -> bool:
+    """
+    Whether the project gets a continuous aggregate for its single dimension views
+    """
+    max_samples = get_settings().MAX_SAMPLES
+    return project.sampleLength > max_samples and dimension_interval(project, max_samples) > 0
+
+
+def dimension_aggregate_query(project: ProjectDB, where: str) -> str:
+    """
+    Query of the columns sample_id, bucket, avg, max and min of the dimension aggregate
+    """
+    # max_value of the aggregate is the range above min_value
+    return f"""
+                SELECT "sample_id", timestamp as bucket, avg_value as avg, min_value + max_value as max, min_value as min
+                FROM "aggregated_{project.id}_dimension"
+                WHERE {where}
+                """
+
+
+def raw_bucket_query(project: ProjectDB, interval: float, where: str) -> str:
+    """
+    Query of the columns sample_id, bucket, avg, max and min of the raw table in buckets of interval seconds,
+    for projects ingested without a dimension aggregate
+    """
+    return f"""
+                SELECT "sample_id", time_bucket('{interval} seconds', ts) as bucket, avg(value) as avg, max(value) as max, min(value) as min
+                FROM "{project.id}"
+                WHERE {where}
+                GROUP BY "sample_id", bucket
+                """
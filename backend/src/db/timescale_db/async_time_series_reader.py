@@ -0,0 +1,118 @@
+from typing import List, Union
+
+from src.config.settings import get_settings
+from src.db.timescale_db.async_tsdb_connector_pool import AsyncTimescaleDBConnectorPool
+from src.models.models.project import ProjectDB, Project
+from src.models.models.time_series import TimeSeries, TimeSeriesProject, TimeSeriesSample
+
+
+async def query_time_series_sample(project: Union[Project, ProjectDB], sample: int, connector: AsyncTimescaleDBConnectorPool) -> dict:
+    """
+    Queries a sample for a project.
+    """
+    sample_idx = sample - 1
+    async with connector.connection() as conn:
+        data = await conn.fetchval(f"""
+                    SELECT json_agg(
+                        json_build_object(
+                            'id', id,
+                            'data', data,
+                            'timestamps', timestamps
+                        )
+                    )
+                    FROM (
+                        SELECT timeseries_id + 1 as id, array_agg(value ORDER BY ts) as data, array_agg(EXTRACT(EPOCH FROM ts)::float * 1000 ORDER BY ts) as timestamps
+                        FROM "{project.id}"
+                        WHERE sample_id = $1
+                        GROUP BY timeseries_id
+                        ORDER BY timeseries_id
+                    ) as agg
+                    """, sample_idx)
+    return {
+        'id': sample,
+        'sample': data
+    }
+
+
+async def query_time_series_sample_dimension(project: ProjectDB, sample: int, dimension: int, connector: AsyncTimescaleDBConnectorPool) -> TimeSeries:
+    """
+    Queries the timescale database for a single dimension of a timeseries
+    """
+    sample_idx = sample - 1
+    dimension_index = dimension - 1
+    if sample == 0:
+        where, args = """ WHERE timeseries_id = $1 """, (dimension_index,)
+    else:
+        where, args = """ WHERE timeseries_id = $1 AND sample_id = $2 """, (dimension_index, sample_idx)
+    async with connector.connection() as conn:
+        data = await conn.fetch(f"""
+                    SELECT value, EXTRACT(EPOCH FROM ts)::float * 1000
+                    FROM "{project.id}"
+                    {where}
+                    ORDER BY ts
+                    """, *args)
+    return TimeSeries(id=dimension + 1,
+                      data=[x[0] for x in data] if project.hasTimestamps else list(data),
+                      timestamps=[x[1] for x in data] if project.hasTimestamps else list(range(len(data[0]))))
+
+
+async def query_time_series_dimension(project: ProjectDB, dimension: int, connector: AsyncTimescaleDBConnectorPool) -> TimeSeries:
+    """
+    Queries the timescale database for a single dimension of a timeseries
+    """
+    return await query_time_series_sample_dimension(project, 0, dimension, connector)
+
+
+async def query_time_series_samples(project: ProjectDB, connector: AsyncTimescaleDBConnectorPool) -> List[dict]:
+    n_values = project.samples * project.sampleLength * project.dimensions
+    modifier = str(project.id) + "_lttb" if n_values > get_settings().MAX_DATA_POINTS else str(project.id)
+    async with connector.connection() as conn:
+        data = await conn.fetchval(f"""
+                        SELECT json_agg(
+                            json_build_object(
+                                'id', sample,
+                                'sample', sample_data
+                            )
+                        )
+                        FROM(
+                            SELECT sample, json_agg(
+                                    json_build_object(
+                                        'id', series,
+                                        'data', data,
+                                        'timestamps', timestamps
+                                    )
+                            ) as sample_data
+                            FROM (
+                                SELECT sample_id + 1 as sample, timeseries_id + 1 as series, array_agg(value ORDER BY ts) as data, array_agg(EXTRACT(EPOCH FROM ts)::float * 1000 ORDER BY ts) as timestamps
+                                FROM "{modifier}"
+                                GROUP BY sample_id, timeseries_id
+                                ORDER BY sample_id, timeseries_id
+                            ) as agg
+                            GROUP BY sample
+                            ORDER BY sample
+                        ) as samples
+                        """)
+    return data or []
+
+
+async def query_time_series(project: ProjectDB, connector: AsyncTimescaleDBConnectorPool) -> TimeSeriesProject:
+    """
+    Queries the TimescaleDB to create TimeSeriesProject Object
+    """
+    async with connector.connection() as conn:
+        data = await conn.fetchval(f"""
+                        SELECT json_agg(
+                                json_build_object(
+                                    'id', series,
+                                    'data', data,
+                                    'timestamps', timestamps
+                                )
+                        )
+                        FROM (
+                            SELECT timeseries_id + 1 as series, array_agg(value ORDER BY ts) as data, array_agg(EXTRACT(EPOCH FROM ts)::float * 1000 ORDER BY ts) as timestamps
+                            FROM "{project.id}"
+                            GROUP BY timeseries_id
+                            ORDER BY timeseries_id
+                        ) as agg
+                    """)
+    return TimeSeriesProject(samples=[TimeSeriesSample(id=0, sample=data)])
@@ -0,0 +1,90 @@
+from itertools import groupby
+
+from asyncpg.exceptions import UndefinedTableError
+
+from src.db.timescale_db.aggregation import dimension_aggregate_query, dimension_interval, raw_bucket_query
+from src.db.timescale_db.async_tsdb_connector_pool import AsyncTimescaleDBConnectorPool
+from src.models.models.project import Project, ProjectDB
+from src.models.models.time_series import TimeSeries, TimeSeriesProject, TimeSeriesSample
+
+
+async def query_time_series_sample_agg(project: ProjectDB, sample: int, connector: AsyncTimescaleDBConnectorPool, max_samples: int) -> TimeSeriesSample:
+    """
+    Queries all dimensions of a sample from the continuous aggregate in a single query, sample 0 concatenates all samples
+    """
+    if sample == 0:
+        where, args = "", ()
+    else:
+        where, args = """ WHERE "sample_id" = $1 """, (sample - 1,)
+    async with connector.connection() as conn:
+        rows = await conn.fetch(f"""
+                        SELECT timeseries_id, EXTRACT(EPOCH FROM timestamp)::float * 1000, avg_value, max_value, min_value
+                        FROM "aggregated_{project.id}"
+                        {where}
+                        ORDER BY timeseries_id, "sample_id", timestamp
+                           ;""", *args)
+    data = {dimension: list(group) for dimension, group in groupby(rows, key=lambda x: x[0])}
+    # max_value of the aggregate already is the range above min_value
+    return TimeSeriesSample(id=0, sample=[(TimeSeries(id=idx + 1,
+                                                      data_min=list(map(lambda x: x[4], d)),
+                                                      data_max=list(map(lambda x: x[3], d)),
+                                                      data=list(map(lambda x: x[2], d)),
+                                                      timestamps=list(map(lambda x: x[1], d))))
+                                          for idx, d in ((idx, data.get(idx, [])) for idx in range(project.dimensions))])
+
+
+async def query_time_series_agg(project: Project, connector: AsyncTimescaleDBConnectorPool) -> TimeSeriesProject:
+    """
+    Queries the TimescaleDB to create TimeSeriesProject Object
+    """
+    async with connector.connection() as conn:
+        data = await conn.fetchval(f"""
+                        SELECT json_agg(
+                                json_build_object(
+                                    'id', series,
+                                    'data', data,
+                                    'data_min', data_min,
+                                    'data_max', data_max,
+                                    'timestamps', timestamps
+                                )
+                        )
+                        FROM (
+                            SELECT timeseries_id + 1 as series, array_agg(EXTRACT(EPOCH FROM timestamp)::float * 1000 ORDER BY timestamp) as timestamps, array_agg(avg_value ORDER BY timestamp) as data, array_agg(max_value ORDER BY timestamp) as data_max, array_agg(min_value ORDER BY timestamp) as data_min
+                            FROM "aggregated_{project.id}"
+                            GROUP BY timeseries_id
+                            ORDER BY timeseries_id
+                        ) as agg
+                    """)
+    return TimeSeriesProject(samples=[TimeSeriesSample(id=0, sample=data)])
+
+
+async def query_time_series_sample_dimension_agg(project: ProjectDB, sample: int, dimension: int, connector: AsyncTimescaleDBConnectorPool, max_samples) -> TimeSeries:
+    """
+    Queries a time bucketed single dimension of a timeseries from the dimension aggregate of the project,
+    projects ingested without it are bucketed from the raw table
+    """
+    sample_idx = sample - 1
+    dimension_index = dimension - 1
+    if sample == 0:
+        where, args = """ "timeseries_id" = $1 """, (dimension_index,)
+    else:
+        where, args = """ "timeseries_id" = $1 and "sample_id" = $2 """, (dimension_index, sample_idx)
+
+    async def fetch(buckets: str):
+        async with connector.connection() as conn:
+            return await conn.fetch(f"""
+                        SELECT EXTRACT(EPOCH FROM bucket)::float * 1000, avg, max, min
+                        FROM ({buckets}
+                        ) as agg
+                        ORDER BY "sample_id", bucket
+                           ;""", *args)
+
+    try:
+        data = await fetch(dimension_aggregate_query(project, where))
+    except UndefinedTableError:
+        data = await fetch(raw_bucket_query(project, dimension_interval(project, max_samples), where))
+    return TimeSeries(id=dimension,
+                      data_min=list(map(lambda x: x[3], data)),
+                      data_max=list(map(lambda x: x[2] - x[3], data)),
+                      data=list(map(lambda x: x[1], data)),
+                      timestamps=list(map(lambda x: x[0], data)))
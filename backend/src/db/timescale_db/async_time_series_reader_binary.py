@@ -0,0 +1,131 @@
+from typing import List
+
+from asyncpg.exceptions import UndefinedTableError
+
+from src.config.settings import get_settings
+from src.controllers.util.time_series_frames import SeriesColumns, split_series
+from src.db.timescale_db.aggregation import dimension_aggregate_query, dimension_interval, raw_bucket_query
+from src.db.timescale_db.async_tsdb_connector_pool import AsyncTimescaleDBConnectorPool
+from src.db.timescale_db.binary_copy import decode_binary_copy
+from src.models.models.project import ProjectDB
+
+RAW_COLUMNS = [('sample', 'int4'), ('series', 'int4'), ('timestamps', 'int8'), ('data', 'float8')]
+AGG_COLUMNS = RAW_COLUMNS + [('data_min', 'float8'), ('data_max', 'float8')]
+EPOCH_MS = "round(EXTRACT(EPOCH FROM {})::float * 1000)::bigint"
+
+
+async def copy_columns(connector: AsyncTimescaleDBConnectorPool, query: str, *args, columns) -> List[SeriesColumns]:
+    """
+    Runs a query as binary COPY and decodes the result straight into NumPy buffers
+    """
+    buffer = bytearray()
+
+    async def _write(chunk):
+        buffer.extend(chunk)
+
+    async with connector.connection() as conn:
+        await conn.copy_from_query(query, *args, output=_write, format='binary')
+    return split_series(decode_binary_copy(buffer, columns))
+
+
+async def query_time_series_binary(project: ProjectDB, connector: AsyncTimescaleDBConnectorPool) -> List[SeriesColumns]:
+    """
+    Queries all dimensions of a project, samples are concatenated
+    """
+    return await copy_columns(connector, f"""
+                        SELECT 0, timeseries_id + 1, {EPOCH_MS.format('ts')}, coalesce(value, 'NaN')
+                        FROM "{project.id}"
+                        ORDER BY timeseries_id, ts
+                    """, columns=RAW_COLUMNS)
+
+
+async def query_time_series_agg_binary(project: ProjectDB, connector: AsyncTimescaleDBConnectorPool) -> List[SeriesColumns]:
+    """
+    Queries all dimensions of a project from the aggregated view
+    """
+    return await copy_columns(connector, f"""
+                        SELECT 0, timeseries_id + 1, {EPOCH_MS.format('timestamp')}, coalesce(avg_value, 'NaN'), coalesce(min_value, 'NaN'), coalesce(max_value, 'NaN')
+                        FROM "aggregated_{project.id}"
+                        ORDER BY timeseries_id, timestamp
+                    """, columns=AGG_COLUMNS)
+
+
+async def query_time_series_samples_binary(project: ProjectDB, connector: AsyncTimescaleDBConnectorPool) -> List[SeriesColumns]:
+    """
+    Queries all samples of a project
+    """
+    n_values = project.samples * project.sampleLength * project.dimensions
+    modifier = str(project.id) + "_lttb" if n_values > get_settings().MAX_DATA_POINTS else str(project.id)
+    return await copy_columns(connector, f"""
+                        SELECT sample_id + 1, timeseries_id + 1, {EPOCH_MS.format('ts')}, coalesce(value, 'NaN')
+                        FROM "{modifier}"
+                        ORDER BY sample_id, timeseries_id, ts
+                    """, columns=RAW_COLUMNS)
+
+
+async def query_time_series_sample_binary(project: ProjectDB, sample: int, connector: AsyncTimescaleDBConnectorPool) -> List[SeriesColumns]:
+    """
+    Queries a sample for a project.
+    """
+    return await copy_columns(connector, f"""
+                        SELECT sample_id + 1, timeseries_id + 1, {EPOCH_MS.format('ts')}, coalesce(value, 'NaN')
+                        FROM "{project.id}"
+                        WHERE sample_id = $1
+                        ORDER BY timeseries_id, ts
+                    """, sample - 1, columns=RAW_COLUMNS)
+
+
+async def query_time_series_sample_agg_binary(project: ProjectDB, sample: int, connector: AsyncTimescaleDBConnectorPool, max_samples: int) -> List[SeriesColumns]:
+    """
+    Queries all dimensions of a sample from the continuous aggregate in a single query.
+    """
+    if sample == 0:
+        where, args = "", ()
+    else:
+        where, args = """ WHERE "sample_id" = $1 """, (sample - 1,)
+    return await copy_columns(connector, f"""
+                        SELECT 0, timeseries_id + 1, {EPOCH_MS.format('timestamp')}, coalesce(avg_value, 'NaN'), coalesce(min_value, 'NaN'), coalesce(max_value, 'NaN')
+                        FROM "aggregated_{project.id}"
+                        {where}
+                        ORDER BY timeseries_id, "sample_id", timestamp
+                    """, *args, columns=AGG_COLUMNS)
+
+
+async def query_time_series_sample_dimension_binary(project: ProjectDB, sample: int, dimension: int, connector: AsyncTimescaleDBConnectorPool) -> List[SeriesColumns]:
+    """
+    Queries the timescale database for a single dimension of a timeseries
+    """
+    if sample == 0:
+        where, args = """ WHERE timeseries_id = $1 """, (dimension - 1,)
+    else:
+        where, args = """ WHERE timeseries_id = $1 AND sample_id = $2 """, (dimension - 1, sample - 1)
+    return await copy_columns(connector, f"""
+                        SELECT {sample}, timeseries_id + 1, {EPOCH_MS.format('ts')}, coalesce(value, 'NaN')
+                        FROM "{project.id}"
+                        {where}
+                        ORDER BY ts
+                    """, *args, columns=RAW_COLUMNS)
+
+
+async def query_time_series_sample_dimension_agg_binary(project: ProjectDB, sample: int, dimension: int, connector: AsyncTimescaleDBConnectorPool, max_samples: int) -> List[SeriesColumns]:
+    """
+    Queries a time bucketed single dimension of a timeseries from the dimension aggregate of the project,
+    projects ingested without it are bucketed from the raw table
+    """
+    if sample == 0:
+        where, args = """ "timeseries_id" = $1 """, (dimension - 1,)
+    else:
+        where, args = """ "timeseries_id" = $1 and "sample_id" = $2 """, (dimension - 1, sample - 1)
+
+    async def copy(buckets: str) -> List[SeriesColumns]:
+        return await copy_columns(connector, f"""
+                        SELECT {sample}, {dimension}, {EPOCH_MS.format('bucket')}, coalesce(avg, 'NaN'), coalesce(min, 'NaN'), coalesce(max - min, 'NaN')
+                        FROM ({buckets}
+                        ) as agg
+                        ORDER BY "sample_id", bucket
+                    """, *args, columns=AGG_COLUMNS)
+
+    try:
+        return await copy(dimension_aggregate_query(project, where))
+    except UndefinedTableError:
+        return await copy(raw_bucket_query(project, dimension_interval(project, max_samples), where))
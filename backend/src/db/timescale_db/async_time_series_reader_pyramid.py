@@ -0,0 +1,108 @@
+from typing import List, Optional
+
+from asyncpg.exceptions import UndefinedTableError
+
+from src.config.settings import get_settings
+from src.controllers.util.pyramid import bucket_width, choose_level, level_within, merge_buckets
+from src.controllers.util.time_series_frames import SeriesColumns
+from src.db.timescale_db.async_time_series_reader_binary import AGG_COLUMNS, EPOCH_MS, RAW_COLUMNS, copy_columns
+from src.db.timescale_db.async_tsdb_connector_pool import AsyncTimescaleDBConnectorPool
+from src.models.models.project import ProjectDB
+
+# epoch milliseconds to the UTC timestamps of the tables
+FROM_EPOCH_MS = "(to_timestamp(({})::float8 / 1000) AT TIME ZONE 'UTC')"
+
+
+async def _query_extent(project: ProjectDB, sample_idx: int, dimension_index: Optional[int], connector: AsyncTimescaleDBConnectorPool):
+    """
+    First and last timestamp (epoch ms), length and levels of a series, all dimensions of a sample share them.
+    Returns None for projects without a pyramid.
+    """
+    dimension = "" if dimension_index is None else "AND timeseries_id = $2"
+    args = (sample_idx,) if dimension_index is None else (sample_idx, dimension_index)
+    async with connector.connection() as conn:
+        try:
+            return await conn.fetchrow(f"""
+                        SELECT {EPOCH_MS.format('first_ts')}, {EPOCH_MS.format('last_ts')}, n_values, levels
+                        FROM "{project.id}_pyramid_extent"
+                        WHERE sample_id = $1 {dimension}
+                        LIMIT 1
+                    """, *args)
+        except UndefinedTableError:
+            return None
+
+
+async def _query_level(project: ProjectDB, sample: int, dimension: Optional[int], start: Optional[float], end: Optional[float], level: int,
+                       connector: AsyncTimescaleDBConnectorPool, width: float = 0) -> List[SeriesColumns]:
+    """
+    Queries one level of a sample, or of a single dimension, between start and end (epoch ms), sample 0 concatenates all samples.
+    The time predicate is part of the query, so only the chunks and index ranges of the range are read.
+    Buckets are stamped with their start, so the lower bound is moved back by the bucket width to keep the bucket covering start.
+    """
+    filters, args = [], []
+    if sample != 0:
+        args.append(sample - 1)
+        filters.append(f"sample_id = ${len(args)}")
+    if dimension is not None:
+        args.append(dimension - 1)
+        filters.append(f"timeseries_id = ${len(args)}")
+    if start is not None:
+        args.append(start - width)
+        filters.append(f"ts >= {FROM_EPOCH_MS.format(f'${len(args)}')}")
+    if end is not None:
+        args.append(end)
+        filters.append(f"ts <= {FROM_EPOCH_MS.format(f'${len(args)}')}")
+    if level:
+        args.append(level)
+        filters.append(f"level = ${len(args)}")
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    sample_column = "0" if sample == 0 else "sample_id + 1"
+    if level == 0:
+        return await copy_columns(connector, f"""
+                        SELECT {sample_column}, timeseries_id + 1, {EPOCH_MS.format('ts')}, coalesce(value, 'NaN')
+                        FROM "{project.id}"
+                        {where}
+                        ORDER BY timeseries_id, ts
+                    """, *args, columns=RAW_COLUMNS)
+    return await copy_columns(connector, f"""
+                        SELECT {sample_column}, timeseries_id + 1, {EPOCH_MS.format('ts')}, coalesce(avg_value, 'NaN'), coalesce(min_value, 'NaN'), coalesce(max_value - min_value, 'NaN')
+                        FROM "{project.id}_pyramid"
+                        {where}
+                        ORDER BY timeseries_id, ts
+                    """, *args, columns=AGG_COLUMNS)
+
+
+async def query_time_series_view(project: ProjectDB, sample: int, dimension: int, start: Optional[float], end: Optional[float], pixel_width: int,
+                                 connector: AsyncTimescaleDBConnectorPool) -> List[SeriesColumns]:
+    """
+    Queries a sample dimension between start and end (epoch ms) from the coarsest pyramid level that still has at least
+    pixel_width points in that range. Projects without a pyramid are read from the raw data.
+    """
+    level, width = 0, 0
+    extent = await _query_extent(project, sample - 1, dimension - 1, connector)
+    if extent is not None:
+        first, last, n_values, levels = extent
+        factor = get_settings().PYRAMID_FACTOR
+        level = choose_level(n_values, first, last, levels, first if start is None else start, last if end is None else end, pixel_width, factor)
+        width = bucket_width(n_values, first, last, level, factor) if level else 0
+    return await _query_level(project, sample, dimension, start, end, level, connector, width)
+
+
+async def query_time_series_range(project: ProjectDB, sample: int, dimension: Optional[int], start: Optional[float], end: Optional[float], max_points: Optional[int],
+                                  connector: AsyncTimescaleDBConnectorPool) -> List[SeriesColumns]:
+    """
+    Queries a sample, or a single dimension of it, between start and end (epoch ms) with at most max_points points per series.
+    The finest pyramid level within max_points is read, the remaining excess is merged into buckets.
+    """
+    level, width = 0, 0
+    if max_points is not None and sample != 0:
+        extent = await _query_extent(project, sample - 1, None if dimension is None else dimension - 1, connector)
+        if extent is not None:
+            first, last, n_values, levels = extent
+            factor = get_settings().PYRAMID_FACTOR
+            level = level_within(n_values, first, last, levels, first if start is None else start, last if end is None else end, max_points, factor)
+            width = bucket_width(n_values, first, last, level, factor) if level else 0
+    series = await _query_level(project, sample, dimension, start, end, level, connector, width)
+    if max_points is not None:
+        series = [merge_buckets(s, max_points) for s in series]
+    return series
@@ -0,0 +1,66 @@
+from typing import AsyncIterator, Dict, List
+
+import numpy as np
+
+from src.config.settings import get_settings
+from src.controllers.util.time_series_frames import SeriesColumns, split_series
+from src.db.timescale_db.async_time_series_reader_binary import EPOCH_MS
+from src.db.timescale_db.async_tsdb_connector_pool import AsyncTimescaleDBConnectorPool
+from src.models.models.project import ProjectDB
+
+STREAM_COLUMNS = [('sample', np.int32), ('series', np.int32), ('timestamps', np.int64), ('data', np.float64)]
+
+
+def _records_to_columns(records) -> Dict[str, np.ndarray]:
+    return {name: np.fromiter((record[idx] for record in records), dtype=dtype, count=len(records))
+            for idx, (name, dtype) in enumerate(STREAM_COLUMNS)}
+
+
+def _concat(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    return {name: np.concatenate([part[name] for part in parts]) for name, _ in STREAM_COLUMNS}
+
+
+def _group_by_sample(series: List[SeriesColumns]) -> List[List[SeriesColumns]]:
+    samples = []
+    for s in series:
+        if samples and samples[-1][0].sample == s.sample:
+            samples[-1].append(s)
+        else:
+            samples.append([s])
+    return samples
+
+
+async def stream_time_series_samples(project: ProjectDB, connector: AsyncTimescaleDBConnectorPool) -> AsyncIterator[List[SeriesColumns]]:
+    """
+    Streams all samples of a project one at a time through a server side cursor,
+    only the current sample and one batch of rows are held in memory
+    """
+    n_values = project.samples * project.sampleLength * project.dimensions
+    modifier = str(project.id) + "_lttb" if n_values > get_settings().MAX_DATA_POINTS else str(project.id)
+    batch_size = get_settings().STREAM_BATCH_SIZE
+    async with connector.connection() as conn:
+        async with conn.transaction():
+            cursor = await conn.cursor(f"""
+                        SELECT sample_id + 1, timeseries_id + 1, {EPOCH_MS.format('ts')}, coalesce(value, 'NaN')
+                        FROM "{modifier}"
+                        ORDER BY sample_id, timeseries_id, ts
+                    """)
+            # batches of the last sample seen, it may continue in the next batch
+            pending = []
+            while True:
+                records = await cursor.fetch(batch_size)
+                if not records:
+                    break
+                columns = _records_to_columns(records)
+                last = columns['sample'][-1]
+                if pending and pending[0]['sample'][0] == last:
+                    pending.append(columns)
+                    continue
+                split = int(np.searchsorted(columns['sample'], last, side='left'))
+                complete = _concat(pending + [{name: values[:split] for name, values in columns.items()}])
+                pending = [{name: values[split:] for name, values in columns.items()}]
+                for sample in _group_by_sample(split_series(complete)):
+                    yield sample
+            if pending:
+                for sample in _group_by_sample(split_series(_concat(pending))):
+                    yield sample
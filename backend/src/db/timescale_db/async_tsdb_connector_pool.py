@@ -0,0 +1,52 @@
+import json
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import asyncpg
+
+from src.config.settings import get_settings
+
+
+class AsyncTimescaleDBConnectorPool(object):
+    pool = None
+    connected = False
+
+    """
+    Initializes an asyncio connection pool to the TimescaleDB
+    """
+
+    async def disconnect(self):
+        """
+        Closes all db connections
+        """
+        await self.pool.close()
+        self.connected = False
+
+    async def connect(self):
+        """
+        Reconnects to a database, if it has been closed by @disconnect before
+        """
+        config = get_settings()
+        if not self.connected:
+            self.pool = await asyncpg.create_pool(min_size=config.db_pool_min_conn, max_size=config.db_pool_max_conn, user=config.db_user, password=config.db_pw, host=config.db_url, port=int(config.db_port), database=config.db_database,
+                                                  max_inactive_connection_lifetime=config.db_pool_max_lifetime, init=self.__init_connection)
+            self.connected = True
+
+    @asynccontextmanager
+    async def connection(self):
+        """
+        Leases a connection from the pool and returns it once the block is left
+        """
+        await self.connect()
+        async with self.pool.acquire(timeout=get_settings().db_pool_timeout) as conn:
+            yield conn
+
+    @staticmethod
+    async def __init_connection(conn):
+        # decode json aggregates like psycopg2 does
+        await conn.set_type_codec('json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+@lru_cache()
+def get_async_pool() -> AsyncTimescaleDBConnectorPool:
+    return AsyncTimescaleDBConnectorPool()
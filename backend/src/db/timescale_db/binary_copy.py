@@ -0,0 +1,77 @@
+"""
+    Helpers for the binary COPY format of PostgreSQL
+
+    Every row of a binary COPY stream consists of an int16 field count followed by an int32 length and the
+    big-endian value of each field. Since we only transfer fixed width columns, rows have a constant size and
+    can be mapped onto a NumPy structured dtype without touching single values in Python.
+"""
+import io
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_TYPES = {
+    'int4': np.dtype('>i4'),
+    'int8': np.dtype('>i8'),
+    'float8': np.dtype('>f8'),
+    # microseconds since 2000-01-01
+    'timestamp': np.dtype('>i8'),
+}
+PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+
+
+def _row_dtype(columns: Sequence[Tuple[str, str]]) -> np.dtype:
+    fields = [('n_fields', '>i2')]
+    for name, pg_type in columns:
+        fields.append((f'{name}_length', '>i4'))
+        fields.append((name, COPY_TYPES[pg_type]))
+    return np.dtype(fields)
+
+
+def decode_binary_copy(buffer, columns: Sequence[Tuple[str, str]]) -> Dict[str, np.ndarray]:
+    """
+    Decodes a binary COPY stream of fixed width, non-null columns into native NumPy arrays
+    """
+    view = memoryview(buffer)
+    if bytes(view[:len(COPY_SIGNATURE)]) != COPY_SIGNATURE:
+        raise ValueError("Invalid binary copy signature.")
+    offset = len(COPY_SIGNATURE) + 4
+    extension = int(np.frombuffer(view, dtype='>i4', count=1, offset=offset)[0])
+    offset += 4 + extension
+    dtype = _row_dtype(columns)
+    # the stream ends with an int16 -1 trailer
+    n_rows = (len(view) - offset - 2) // dtype.itemsize
+    rows = np.frombuffer(view, dtype=dtype, count=n_rows, offset=offset)
+    if n_rows and ((rows['n_fields'] != len(columns)).any() or any((rows[f'{name}_length'] != COPY_TYPES[pg_type].itemsize).any() for name, pg_type in columns)):
+        raise ValueError("Binary copy contains null or variable width values.")
+    return {name: rows[name].astype(COPY_TYPES[pg_type].newbyteorder('<')) for name, pg_type in columns}
+
+
+def to_pg_timestamps(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Converts datetime64 values to the int64 microseconds since 2000-01-01 of the timestamp wire format
+    """
+    return (timestamps.astype('datetime64[us]') - PG_EPOCH).astype(np.int64)
+
+
+def encode_binary_copy(columns: Sequence[Tuple[str, str]], values: Dict[str, np.ndarray]) -> bytes:
+    """
+    Encodes equally long, non-null NumPy columns into a binary COPY stream, timestamps are passed as datetime64
+    """
+    dtype = _row_dtype(columns)
+    n_rows = len(values[columns[0][0]]) if columns else 0
+    rows = np.empty(n_rows, dtype=dtype)
+    rows['n_fields'] = len(columns)
+    for name, pg_type in columns:
+        rows[f'{name}_length'] = COPY_TYPES[pg_type].itemsize
+        rows[name] = to_pg_timestamps(values[name]) if pg_type == 'timestamp' else values[name]
+    return b''.join((COPY_SIGNATURE, np.zeros(2, dtype='>i4').tobytes(), rows.tobytes(), np.array(-1, dtype='>i2').tobytes()))
+
+
+def copy_from_arrays(cursor, table: str, columns: Sequence[Tuple[str, str]], values: Dict[str, np.ndarray]) -> None:
+    """
+    Copies NumPy columns into a table in the binary COPY format
+    """
+    names = ', '.join(name for name, _ in columns)
+    cursor.copy_expert(f'COPY "{table}" ({names}) FROM STDIN WITH (FORMAT binary)', io.BytesIO(encode_binary_copy(columns, values)))
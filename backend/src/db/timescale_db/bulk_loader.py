@@ -0,0 +1,124 @@
+import io
+import threading
+import time
+from queue import Queue
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .binary_copy import encode_binary_copy
+from .tsdb_connector_pool import TimescaleDBConnectorPool
+from ...controllers.util.sample_spool import SampleSpool
+
+
+class BulkLoader:
+    """
+    Copies a SampleSpool into a table over several pooled connections.
+
+    The spool is split into sample ranges, which are encoded in the binary COPY format by the calling thread and
+    handed to one loader thread per connection through a bounded queue. Encoding blocks while the queue is full, so
+    at most queue_size + n_connections partitions are held in memory.
+    """
+
+    def __init__(self, connector: TimescaleDBConnectorPool, table: str, columns: Sequence[Tuple[str, str]],
+                 column_names: Dict[str, str], n_connections: int = 4, queue_size: int = 8):
+        self.connector = connector
+        self.table = table
+        self.columns = columns
+        # partition column -> table column
+        self.column_names = column_names
+        self.n_connections = n_connections
+        self.queue_size = queue_size
+        self.rows = 0
+        self.started = None
+        self._lock = threading.Lock()
+        self._error = None
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.started is None:
+            return 0.0
+        elapsed = time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def load(self, values: SampleSpool, batch_rows: int, progress: Optional[Callable[['BulkLoader'], None]] = None) -> None:
+        """
+        Copies all samples of the spool, progress is called whenever a partition was copied
+        """
+        self.load_columns((values.columns(samples) for samples in values.batches(batch_rows)), progress)
+
+    def load_columns(self, partitions: Iterable[Dict[str, np.ndarray]], progress: Optional[Callable[['BulkLoader'], None]] = None) -> None:
+        """
+        Copies partitions of columns, which are only produced while the queue has room.
+        The transactions of all connections are committed once every partition was copied, if any copy or partition
+        failed all of them are rolled back.
+        """
+        queue = Queue(maxsize=self.queue_size)
+        # passed by every loader once its partitions are copied and by the producer once all partitions are queued
+        copied = threading.Barrier(self.n_connections + 1)
+        loaders = [threading.Thread(target=self.__load_partitions, args=(queue, copied, progress), daemon=True) for _ in range(self.n_connections)]
+        self.rows, self.started, self._error = 0, time.perf_counter(), None
+        for loader in loaders:
+            loader.start()
+        try:
+            for columns in partitions:
+                if self._error is not None:
+                    break
+                data = {name: columns[key] for key, name in self.column_names.items()}
+                queue.put((encode_binary_copy(self.columns, data), len(next(iter(data.values())))))
+        except BaseException as e:
+            self.__fail(e)
+            raise
+        finally:
+            for _ in loaders:
+                queue.put(None)
+            copied.wait()
+            for loader in loaders:
+                loader.join()
+        if self._error is not None:
+            raise self._error
+
+    def __load_partitions(self, queue: Queue, copied: threading.Barrier, progress: Optional[Callable[['BulkLoader'], None]]):
+        names = ', '.join(name for name, _ in self.columns)
+        waited = False
+        try:
+            with self.connector.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    while True:
+                        partition = queue.get()
+                        if partition is None:
+                            break
+                        data, n_rows = partition
+                        cursor.copy_expert(f'COPY "{self.table}" ({names}) FROM STDIN WITH (FORMAT binary)', io.BytesIO(data))
+                        with self._lock:
+                            self.rows += n_rows
+                        if progress is not None:
+                            progress(self)
+                except Exception as e:
+                    self.__fail(e)
+                    self.__drain(queue)
+                waited = True
+                copied.wait()
+                if self._error is None:
+                    connection.commit()
+                else:
+                    connection.rollback()
+                cursor.close()
+        except Exception as e:
+            self.__fail(e)
+            if not waited:
+                self.__drain(queue)
+                copied.wait()
+
+    def __fail(self, error: BaseException):
+        with self._lock:
+            self._error = self._error or error
+
+    @staticmethod
+    def __drain(queue: Queue):
+        """
+        Takes partitions up to the end marker, so the producer never blocks on a full queue
+        """
+        while queue.get() is not None:
+            pass
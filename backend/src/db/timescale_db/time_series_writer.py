@@ -1,26 +1,34 @@
 import logging
-import math
-from datetime import datetime
-from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 from uuid import UUID
 
-import lttb
 import numpy as np
 from fastapi import HTTPException
-from joblib import Parallel, delayed
-from pgcopy import CopyManager
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, ISOLATION_LEVEL_DEFAULT
 
 from src.controllers.cache_controller import cache
+from .aggregation import aggregate_interval, dimension_interval, has_dimension_aggregate
+from .binary_copy import copy_from_arrays
+from .bulk_loader import BulkLoader
 from .tsdb_connector_pool import TimescaleDBConnectorPool
 from ...config.settings import get_settings
+from ...controllers.util.downsampling import downsample_spool
+from ...controllers.util.pyramid import spool_extents, spool_pyramid
+from ...controllers.util.sample_spool import SampleSpool
 from ...controllers.util.time_util import current_time
 from ...models.models.project import ProjectDB
 
 
 class TimeSeriesWriter:
-    columns = ['ts', 'sample_id', 'timeseries_id', 'value']
+    columns = [('ts', 'timestamp'), ('sample_id', 'int4'), ('timeseries_id', 'int4'), ('value', 'float8')]
+    pyramid_columns = [('level', 'int4'), ('sample_id', 'int4'), ('timeseries_id', 'int4'), ('ts', 'timestamp'),
+                       ('min_value', 'float8'), ('max_value', 'float8'), ('avg_value', 'float8')]
+    extent_columns = [('sample_id', 'int4'), ('timeseries_id', 'int4'), ('first_ts', 'timestamp'), ('last_ts', 'timestamp'),
+                      ('n_values', 'int8'), ('levels', 'int4')]
+    index_keys = ['sample_id, ts DESC', 'timeseries_id, ts DESC']
+    # create_hypertable skips its (ts DESC) index in the deferred mode
+    deferred_index_keys = index_keys + ['ts DESC']
 
     def __init__(self, connector: TimescaleDBConnectorPool, project: ProjectDB = None):
         self.project = project
@@ -29,13 +37,16 @@ class TimeSeriesWriter:
             self.n_values = project.samples * project.sampleLength * project.dimensions
             self.no_lttb = self.n_values > get_settings().MAX_DATA_POINTS
         self.progress = 0
+        self.rows_per_second = None
 
-    def write(self, values: Dict):
+    def write(self, values: SampleSpool):
         if self.project is None:
             raise HTTPException(status_code=400, detail="Invalid project.")
         logger = logging.getLogger("gideon")
+        # drop cached data of a previous integration
+        cache.delete_cache(self.project.id)
         logger.debug(f"{current_time()} create tables")
-        self.__create_tables()
+        self.__create_tables(values)
         self.progress = 5
         logger.debug(f"{current_time()} lttb subsample")
         self.__lttb_subsample(values)
@@ -43,26 +54,42 @@ class TimeSeriesWriter:
         logger.debug(f"{current_time()} insert vales")
         self.__insert_data(values)
         self.progress = 80
+        if get_settings().INGEST_DEFER_INDEXES:
+            logger.debug(f"{current_time()} create indexes")
+            self.__create_indexes()
+            self.progress = 85
+        logger.debug(f"{current_time()} build pyramid")
+        self.__create_pyramid(values)
+        self.progress = 90
         logger.debug(f"{current_time()} create aggregated view")
         self.__create_aggregated_view()
         self.progress = 95
         logger.debug(f"{current_time()} update cache")
+        if self.n_values <= get_settings().MAX_DATA_POINTS:
+            # the project is cached from the loaded table, stores other workers filled while it was loading belong to the previous generation
+            cache.invalidate(self.project.id)
         if self.no_lttb:
             cache.db_to_cache(project=self.project, connector=self.connector)
+        logger.debug(f"{current_time()} build feature index")
+        cache.feature_index(project=self.project, connector=self.connector, rebuild=True)
         logger.debug(f"{current_time()} all done")
 
     def remove(self, project: UUID):
-        connection = self.connector.get_conn()
-        cursor = connection.cursor()
-        cursor.execute(f'DROP TABLE IF EXISTS "{project}" CASCADE;')
-        cursor.execute(f'DROP TABLE IF EXISTS "{project}_lttb" CASCADE;')
-        connection.commit()
-        cursor.close()
-
-    def __create_tables(self):
+        with self.connector.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f'DROP TABLE IF EXISTS "{project}" CASCADE;')
+            cursor.execute(f'DROP TABLE IF EXISTS "{project}_lttb" CASCADE;')
+            cursor.execute(f'DROP TABLE IF EXISTS "{project}_pyramid" CASCADE;')
+            cursor.execute(f'DROP TABLE IF EXISTS "{project}_pyramid_extent" CASCADE;')
+            connection.commit()
+            cursor.close()
+
+    def __create_tables(self, values: SampleSpool):
         """
-        Adds the given project to the database
+        Adds the given project to the database, the indexes of the hypertable are created after loading in the deferred ingest mode
         """
+        deferred = get_settings().INGEST_DEFER_INDEXES
+        indexes = "".join(f'CREATE INDEX ON "{self.project.id}" ({keys});' for keys in self.index_keys)
         queries = [f"""DROP TABLE IF EXISTS "{self.project.id}";
                        CREATE TABLE "{self.project.id}"(
                             ts {"TIMESTAMP NOT NULL" if self.project.hasTimestamps else "INTEGER"},
@@ -70,9 +97,8 @@ class TimeSeriesWriter:
                             timeseries_id INTEGER,
                             value DOUBLE PRECISION
                        );
-                       CREATE INDEX ON "{self.project.id}" (sample_id, ts DESC);
-                       CREATE INDEX ON "{self.project.id}" (timeseries_id, ts DESC);
-                       SELECT create_hypertable('{self.project.id}', 'ts');
+                       {"" if deferred else indexes}
+                       SELECT create_hypertable('{self.project.id}', 'ts', create_default_indexes => {"FALSE" if deferred else "TRUE"}{self.__chunk_time_interval(values)});
                     """]
         if self.no_lttb:
             queries.append(f"""                 
@@ -86,80 +112,159 @@ class TimeSeriesWriter:
                        CREATE INDEX ON "{self.project.id}_lttb" (sample_id, ts DESC);
                        CREATE INDEX ON "{self.project.id}_lttb" (timeseries_id, ts DESC);
                        """)
-        connection = self.connector.get_conn()
-        cursor = connection.cursor()
-        [cursor.execute(query) for query in queries]
-        connection.commit()
-        cursor.close()
+        with self.connector.connection() as connection:
+            cursor = connection.cursor()
+            [cursor.execute(query) for query in queries]
+            connection.commit()
+            cursor.close()
 
-    def __lttb_subsample(self, values: Dict):
+    def __chunk_time_interval(self, values: SampleSpool) -> str:
         """
-        Sample time series using lttb sampling
+        Chooses the chunk interval, so a chunk holds about INGEST_CHUNK_ROWS rows of the project.
+        Samples may overlap in time, so the row density is taken from the time range covered by all samples.
+        """
+        if not self.project.hasTimestamps or not len(values.timestamps):
+            return ""
+        span = int((values.timestamps.max() - values.timestamps.min()) / np.timedelta64(1, 'us'))
+        if span <= 0:
+            return ""
+        # microseconds, at least one second per chunk
+        interval = max(int(span * get_settings().INGEST_CHUNK_ROWS / max(values.n_values, 1)), 10 ** 6)
+        return f", chunk_time_interval => {interval}"
+
+    def __create_indexes(self):
+        """
+        Builds the indexes of the loaded hypertable, each index is built on its own connection
         """
 
-        def downsample_func(sample, dimension):
-            sample_results = []
-            for key, values in dimension.items():
-                timeseries = []
-                timeseries.append(list(map(lambda dimension_values: dimension_values[0].timestamp(), values)))
-                timeseries.append(list(map(lambda dimension_values: dimension_values[3], values)))
-                timeseries = lttb.downsample(data=np.array(timeseries).T, n_out=math.ceil(factor * len(values)))
-                sample_results.append([[ts, sample, key, value] for ts, value in zip(timeseries.T[0], timeseries.T[1])])
-            return list(chain.from_iterable(sample_results))
+        def create_index(keys: str):
+            with self.connector.connection() as connection:
+                # transaction_per_chunk can not run inside a transaction block
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(f"SET maintenance_work_mem = '{get_settings().INGEST_INDEX_MEMORY}'")
+                    cursor.execute(f'CREATE INDEX ON "{self.project.id}" ({keys}) WITH (timescaledb.transaction_per_chunk)')
+                finally:
+                    # the setting is kept by the session, which goes back to the pool
+                    cursor.execute("RESET maintenance_work_mem")
+                    cursor.close()
+                    connection.set_isolation_level(ISOLATION_LEVEL_DEFAULT)
+
+        n_workers = len(self.deferred_index_keys) if get_settings().INGEST_PARALLEL_INDEXES else 1
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            list(executor.map(create_index, self.deferred_index_keys))
 
+    def __lttb_subsample(self, values: SampleSpool):
+        """
+        Sample time series using lttb sampling
+        """
+        config = get_settings()
         self.n_values = self.project.samples * self.project.sampleLength * self.project.dimensions
-        connection = self.connector.get_conn()
-        if self.n_values > get_settings().MAX_DATA_POINTS:
-            factor = get_settings().MAX_DATA_POINTS / self.n_values
-            export = list(chain.from_iterable(Parallel(n_jobs=-1)(delayed(downsample_func)(sample, dimension) for sample, dimension in values.items())))
-            mgr = CopyManager(connection, str(self.project.id) + "_lttb", self.columns)
-            export = list(map(lambda x: [datetime.fromtimestamp(x[0]), x[1], x[2], x[3]], export))
-            mgr.threading_copy(export)
-            connection.commit()
-            cache.cache_project_init(export, self.project)
+        if self.n_values > config.MAX_DATA_POINTS:
+            factor = config.MAX_DATA_POINTS / self.n_values
+            with downsample_spool(values, factor, config.INGEST_BATCH_ROWS, config.LTTB_WORKERS) as export:
+                with self.connector.connection() as connection:
+                    cursor = connection.cursor()
+                    for start in range(0, len(export['values']), config.INGEST_BATCH_ROWS):
+                        batch = {name: column[start:start + config.INGEST_BATCH_ROWS] for name, column in export.items()}
+                        copy_from_arrays(cursor, f'{self.project.id}_lttb', self.columns, self.__copy_columns(batch))
+                    connection.commit()
+                    cursor.close()
+                # stores other workers filled from the partially copied table belong to the previous generation
+                cache.invalidate(self.project.id)
+                cache.cache_project_init(export['sample'], export['series'], export['timestamps'], export['values'], self.project)
+                # the last batch views the shared output, which is closed when the context is left
+                batch = None
             self.no_lttb = False
 
-    def __insert_data(self, values: Dict):
+    def __insert_data(self, values: SampleSpool):
         """
-        Inserts data into previously create time series table
+        Inserts data into previously create time series table, sample ranges are copied over several connections
         """
-        values = list(chain.from_iterable([value for sample_id, dimension in values.items() for key, value in dimension.items()]))
-        connection = self.connector.get_conn()
-        cursor = connection.cursor()
-        mgr = CopyManager(connection, str(self.project.id), self.columns)
-        mgr.threading_copy(values)
-        connection.commit()
-        cursor.close()
+        config = get_settings()
+        loader = BulkLoader(self.connector, str(self.project.id), self.columns, {'timestamps': 'ts', 'sample': 'sample_id', 'series': 'timeseries_id', 'values': 'value'},
+                            n_connections=config.INGEST_CONNECTIONS, queue_size=config.INGEST_QUEUE_SIZE)
+        total = max(values.n_values, 1)
 
-    def __create_aggregated_view(self):
+        def update_progress(bulk_loader: BulkLoader):
+            self.rows_per_second = bulk_loader.rows_per_second
+            self.progress = 50 + 30 * bulk_loader.rows / total
+
+        loader.load(values, config.INGEST_BATCH_ROWS, update_progress)
+        self.rows_per_second = None
+
+    def __create_pyramid(self, values: SampleSpool):
         """
-        Creates materialized aggregated view for time series
+        Writes the levels of the multi resolution pyramid and the extent of every series, see controllers.util.pyramid
         """
-        connection = self.connector.get_conn()
-        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = connection.cursor()
-        cursor.execute(
-            f"""CREATE MATERIALIZED VIEW "aggregated_{self.project.id}" WITH (timescaledb.continuous, timescaledb.create_group_indexes, timescaledb.materialized_only = true)
-                    AS SELECT 
-                        sample_id, 
-                        timeseries_id,
-                        time_bucket('{self.__calc_agg_interval()} seconds', ts) as timestamp,
-                        avg(value) as avg_value,
-                        (max(value) - min(value)) as max_value,
-                        min(value) as min_value
-                        FROM "{self.project.id}"
-                        GROUP BY sample_id, timeseries_id, timestamp;        
-            """
-        )
-        connection.commit()
-        connection.set_isolation_level(ISOLATION_LEVEL_DEFAULT)
-        cursor.close()
-
-    def __calc_agg_interval(self):
+        config = get_settings()
+        factor, min_points = config.PYRAMID_FACTOR, config.PYRAMID_MIN_POINTS
+        with self.connector.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"""DROP TABLE IF EXISTS "{self.project.id}_pyramid";
+                               CREATE TABLE "{self.project.id}_pyramid"(
+                                    level INTEGER,
+                                    sample_id INTEGER,
+                                    timeseries_id INTEGER,
+                                    ts TIMESTAMP NOT NULL,
+                                    min_value DOUBLE PRECISION,
+                                    max_value DOUBLE PRECISION,
+                                    avg_value DOUBLE PRECISION
+                               );
+                               DROP TABLE IF EXISTS "{self.project.id}_pyramid_extent";
+                               CREATE TABLE "{self.project.id}_pyramid_extent"(
+                                    sample_id INTEGER,
+                                    timeseries_id INTEGER,
+                                    first_ts TIMESTAMP,
+                                    last_ts TIMESTAMP,
+                                    n_values BIGINT,
+                                    levels INTEGER,
+                                    PRIMARY KEY (sample_id, timeseries_id)
+                               );
+                            """)
+            copy_from_arrays(cursor, f'{self.project.id}_pyramid_extent', self.extent_columns, spool_extents(values, factor, min_points))
+            connection.commit()
+            cursor.close()
+        loader = BulkLoader(self.connector, f'{self.project.id}_pyramid', self.pyramid_columns, {name: name for name, _ in self.pyramid_columns},
+                            n_connections=config.INGEST_CONNECTIONS, queue_size=config.INGEST_QUEUE_SIZE)
+        # levels hold about a third of the raw points, so batches of raw points bound the partitions
+        loader.load_columns(spool_pyramid(values, samples, factor, min_points) for samples in values.batches(config.INGEST_BATCH_ROWS))
+        with self.connector.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f'CREATE INDEX ON "{self.project.id}_pyramid" (sample_id, timeseries_id, level, ts)')
+            connection.commit()
+            cursor.close()
+
+    @staticmethod
+    def __copy_columns(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        return {'ts': columns['timestamps'], 'sample_id': columns['sample'], 'timeseries_id': columns['series'], 'value': columns['values']}
+
+    def __create_aggregated_view(self):
         """
-        Calculates aggregation interval
+        Creates materialized aggregated views for time series, long samples get a finer one for their single dimension views
         """
-        data_points = self.project.sampleLength * self.project.dimensions * self.project.samples
-        coeff = data_points / (get_settings().MAX_SAMPLES / 100)
-        time_delta = self.project.sampleTime / self.project.sampleLength
-        return coeff * time_delta
+        views = {f'aggregated_{self.project.id}': aggregate_interval(self.project)}
+        if has_dimension_aggregate(self.project):
+            views[f'aggregated_{self.project.id}_dimension'] = dimension_interval(self.project, get_settings().MAX_SAMPLES)
+        with self.connector.connection() as connection:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            try:
+                cursor = connection.cursor()
+                for view, interval in views.items():
+                    cursor.execute(
+                        f"""CREATE MATERIALIZED VIEW "{view}" WITH (timescaledb.continuous, timescaledb.create_group_indexes, timescaledb.materialized_only = true)
+                            AS SELECT 
+                                sample_id, 
+                                timeseries_id,
+                                time_bucket('{interval} seconds', ts) as timestamp,
+                                avg(value) as avg_value,
+                                (max(value) - min(value)) as max_value,
+                                min(value) as min_value
+                                FROM "{self.project.id}"
+                                GROUP BY sample_id, timeseries_id, timestamp;        
+                    """
+                    )
+                cursor.close()
+            finally:
+                connection.set_isolation_level(ISOLATION_LEVEL_DEFAULT)
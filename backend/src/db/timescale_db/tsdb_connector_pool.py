@@ -1,4 +1,10 @@
-from psycopg2.pool import ThreadedConnectionPool
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from psycopg2 import Error, InterfaceError, OperationalError
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 
 from src.config.settings import get_settings
 
@@ -8,17 +14,29 @@ class TimescaleDBConnectorPool(object):
     connected = False
 
     """
-    Initializes a connection to the TimescaleDB
+    Initializes a connection pool to the TimescaleDB
     """
 
     def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = None
+        self._created = {}
+        self._last_used = {}
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.recycled = 0
+        self._checkout_time = 0.0
+        self._max_checkout_time = 0.0
         self.connect()
 
     def disconnect(self):
         """
-        Closes a db connection
+        Closes all db connections
         """
         self.pool.closeall()
+        self._created.clear()
+        self._last_used.clear()
         self.connected = False
 
     def connect(self):
@@ -27,8 +45,106 @@ class TimescaleDBConnectorPool(object):
         """
         config = get_settings()
         if not self.connected:
-            self.pool = ThreadedConnectionPool(2, 20, user=config.db_user, password=config.db_pw, host=config.db_url, port=config.db_port, database=config.db_database)
+            self.pool = ThreadedConnectionPool(config.db_pool_min_conn, config.db_pool_max_conn, user=config.db_user, password=config.db_pw, host=config.db_url, port=config.db_port, database=config.db_database)
+            self._slots = threading.BoundedSemaphore(config.db_pool_max_conn)
             self.connected = True
 
-    def get_conn(self):
-        return self.pool.getconn()
+    @contextmanager
+    def connection(self):
+        """
+        Leases a healthy connection from the pool and returns it once the block is left
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=get_settings().db_pool_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            raise PoolError("connection pool exhausted")
+        try:
+            conn = self.__checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self._checkout_time += elapsed
+            self._max_checkout_time = max(self._max_checkout_time, elapsed)
+        broken = False
+        try:
+            yield conn
+        except (OperationalError, InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.__checkin(conn, broken)
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def metrics(self) -> dict:
+        """
+        Returns usage statistics of the pool
+        """
+        with self._lock:
+            return {
+                'size': len(self._created),
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'recycled': self.recycled,
+                'checkout_latency_avg_ms': self._checkout_time / self.checkouts * 1000 if self.checkouts else 0.0,
+                'checkout_latency_max_ms': self._max_checkout_time * 1000
+            }
+
+    def __checkout(self):
+        while True:
+            conn = self.pool.getconn()
+            if not self.__is_stale(conn):
+                return conn
+            self.__discard(conn)
+            with self._lock:
+                self.recycled += 1
+
+    def __checkin(self, conn, broken: bool):
+        if broken or conn.closed:
+            self.__discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self.pool.putconn(conn)
+
+    def __discard(self, conn):
+        self._created.pop(id(conn), None)
+        self._last_used.pop(id(conn), None)
+        self.pool.putconn(conn, close=True)
+
+    def __is_stale(self, conn) -> bool:
+        """
+        Checks whether a connection exceeded its lifetime or died while being idle
+        """
+        if conn.closed:
+            return True
+        config = get_settings()
+        now = time.monotonic()
+        created = self._created.setdefault(id(conn), now)
+        if now - created > config.db_pool_max_lifetime:
+            return True
+        if now - self._last_used.get(id(conn), now) > config.db_pool_idle_check:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+                conn.rollback()
+            except Error:
+                return True
+        return False
+
+
+@lru_cache()
+def get_pool() -> TimescaleDBConnectorPool:
+    return TimescaleDBConnectorPool()
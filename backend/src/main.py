@@ -17,6 +17,8 @@ from src.controllers.cache_controller import cache
 from src.controllers.util.file_util import remove_temp
 from src.controllers.util.redis import redis_instance
 from src.db.sqlalchemy.database import init_db
+from src.db.timescale_db.async_tsdb_connector_pool import get_async_pool
+from src.db.timescale_db.tsdb_connector_pool import get_pool
 from src.ws.websocket_manager import manager
 
 
@@ -54,12 +56,18 @@ dictConfig(LogConfig().dict())
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    get_pool()
+    await get_async_pool().connect()
+    cache.start()
 
 
 @app.on_event("shutdown")
-def shutdown_event():
+async def shutdown_event():
     # clean up
-    cache.clear_cache()
+    get_pool().disconnect()
+    await get_async_pool().disconnect()
+    # the cache directory is shared with the other workers, only drop this worker's state
+    cache.close()
     remove_temp()
 
 
@@ -0,0 +1,37 @@
+from pydantic import BaseModel
+
+
+class PoolMetrics(BaseModel):
+    """ PoolMetrics - usage of the TimescaleDB connection pool
+
+        size: Open connections of the pool.
+        in_use: Connections currently leased.
+        waiting: Requests waiting for a free connection.
+        checkouts: Total number of leases.
+        recycled: Connections closed because they were stale or broken.
+        checkout_latency_avg_ms: Average time to lease a connection.
+        checkout_latency_max_ms: Maximum time to lease a connection.
+    """
+    size: int
+    in_use: int
+    waiting: int
+    checkouts: int
+    recycled: int
+    checkout_latency_avg_ms: float
+    checkout_latency_max_ms: float
+
+
+class CacheMetrics(BaseModel):
+    """ CacheMetrics - usage of the in-process cache of open project stores
+
+        entries: Open project stores.
+        max_entries: Maximum number of open project stores.
+        hits: Reads served from an open store.
+        misses: Reads that had to open the project from disk.
+        evictions: Stores dropped to stay within max_entries.
+    """
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+    evictions: int
@@ -75,3 +75,21 @@ class Label(LabelBase):
     class Config:
         orm_mode = True
 
+
+
+class AlignmentProgress(BaseModel):
+    """ Progress of a label alignment, sent on the progress channel of the project
+    """
+    id: UUID
+    progress: float
+    label_class: UUID
+    dimension_idx: int
+
+
+class SimilarWindow(BaseModel):
+    """ A window similar to a queried segment, distance is the DTW distance summed over the dimensions
+    """
+    sample: int
+    start: int
+    end: int
+    distance: float
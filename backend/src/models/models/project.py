@@ -63,3 +63,4 @@ class ProjectStatusUpdate(BaseModel):
     id: UUID
     progress: float
     status: IntegrationStatus
+    rowsPerSecond: Optional[float] = None
@@ -1,2 +1,3 @@
 from .project import Project
 from .label import Label, LabelClass
+from .label_template import AlignedLabel, MedianLabel
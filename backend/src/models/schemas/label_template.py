@@ -0,0 +1,32 @@
+from sqlalchemy import Column, Integer, ForeignKey, LargeBinary, Boolean
+from sqlalchemy.dialects.postgresql import UUID
+
+from src.db.sqlalchemy.database import Base
+
+
+class AlignedLabel(Base):
+    """
+    A dimension of a label aligned to the reference of its class, data is a float64 blob
+    """
+    __tablename__ = "aligned_labels"
+    label_id = Column(UUID(as_uuid=True), ForeignKey('labels.id', ondelete="CASCADE"), primary_key=True)
+    dimension_idx = Column(Integer, primary_key=True)
+    project = Column(UUID(as_uuid=True), ForeignKey('projects.id', ondelete="CASCADE"), index=True)
+    label_class = Column(UUID(as_uuid=True), ForeignKey('label_classes.id', ondelete="CASCADE"), index=True)
+    reference = Column(Boolean, default=False)
+    # length of the label before the alignment, the longest label of a class is its reference
+    length = Column(Integer)
+    data = Column(LargeBinary)
+
+
+class MedianLabel(Base):
+    """
+    Median of all aligned labels of a class in a dimension, data is a float64 blob.
+    Stale medians wait for their labels to be realigned to a new reference.
+    """
+    __tablename__ = "median_labels"
+    label_class = Column(UUID(as_uuid=True), ForeignKey('label_classes.id', ondelete="CASCADE"), primary_key=True)
+    dimension_idx = Column(Integer, primary_key=True)
+    project = Column(UUID(as_uuid=True), ForeignKey('projects.id', ondelete="CASCADE"), index=True)
+    stale = Column(Boolean, default=False)
+    data = Column(LargeBinary, nullable=True)
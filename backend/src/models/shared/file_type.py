@@ -4,3 +4,7 @@ from enum import Enum
 class FileType(str, Enum):
     json = '.json',
     ts = '.ts'
+    csv = '.csv'
+    parquet = '.parquet'
+    npy = '.npy'
+    npz = '.npz'
@@ -13,6 +13,7 @@ export interface ProjectStatusUpdate {
   id: string;
   progress: number;
   status: IntegrationStatus;
+  rowsPerSecond?: number;
 }
 
 